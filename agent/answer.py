@@ -5,7 +5,9 @@ import sys
 import json
 import time
 import requests
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
+from docindex import DocIndex, text_hash, DOCS_PATH, EMBED_MODEL
+from retrieval import load_backend
 
 # ---------------- CONFIG ----------------
 
@@ -15,7 +17,6 @@ HF_MODEL = "HuggingFaceH4/zephyr-7b-beta"
 HF_API_URL = f"https://router.huggingface.co/models/{HF_MODEL}"
 HF_TOKEN = os.environ.get("HF_API_TOKEN")
 
-DOCS_PATH = "docs/company_info.json"
 OUTPUT_PATH = "answers/latest.json"
 
 MAX_RETRIES = 3
@@ -40,22 +41,29 @@ doc_texts = [d["text"] for d in docs]
 
 # ---------------- EMBEDDINGS ----------------
 
-embedder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+embedder = SentenceTransformer(EMBED_MODEL)
 
-doc_embeddings = embedder.encode(
-    doc_texts,
-    convert_to_tensor=True,
-    normalize_embeddings=True
-)
 
-question_embedding = embedder.encode(
-    question,
-    convert_to_tensor=True,
-    normalize_embeddings=True
-)
+def embed(texts):
+    return embedder.encode(
+        texts,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    )
+
+
+# Only new or changed documents are encoded; the rest come from disk
+index = DocIndex(EMBED_MODEL)
+doc_rows = index.update(doc_texts, embed)
+
+question_embedding = embed(question)
+
+# ---------------- RETRIEVAL ----------------
 
-hits = util.semantic_search(question_embedding, doc_embeddings, top_k=2)
-context = "\n".join(doc_texts[h["corpus_id"]] for h in hits[0])
+# Exact for small corpora, else a prebuilt ANN index (see retrieval.py)
+backend = load_backend(index, [text_hash(t) for t in doc_texts], doc_rows)
+hits = backend.search(question_embedding, 2)
+context = "\n".join(doc_texts[h["corpus_id"]] for h in hits)
 
 # ---------------- PROMPT ----------------
 
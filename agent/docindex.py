@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# docindex.py
+# On-disk document embedding index for answer.py.
+#
+# Embeddings live in INDEX_DIR/embeddings-<n>.f32, a raw float32 (rows x
+# dim) matrix that is memory-mapped, not loaded. INDEX_DIR/meta.json names
+# that file and maps each document's SHA-256 to its row. Only documents
+# whose text is not indexed yet get encoded. Rows of changed or removed
+# documents stay behind until they outnumber the live ones; compaction then
+# writes a new matrix file, so meta.json never points at a half-written one.
+
+import os
+import json
+import hashlib
+import numpy as np
+
+# ---------------- CONFIG ----------------
+
+# Shared with answer.py and retrieval.py's offline build
+DOCS_PATH = "docs/company_info.json"
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+INDEX_DIR = os.environ.get("DOCS_INDEX_DIR", "docs/.index")
+META_FILE = "meta.json"
+
+# ---------------- INDEX ----------------
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DocIndex:
+    """Embeddings of one document set, keyed by content hash.
+
+    ``embedder`` is only called for texts that are not indexed yet, so a
+    caller can pass a lazily-loading wrapper and skip loading the model
+    when nothing changed.
+    """
+
+    def __init__(self, model_name, index_dir=INDEX_DIR):
+        self.model_name = model_name
+        self.index_dir = index_dir
+        self.meta_path = os.path.join(index_dir, META_FILE)
+        self.meta = self._load_meta()
+
+    def _load_meta(self):
+        empty = {"model": self.model_name, "file": "embeddings-0.f32",
+                 "dim": None, "count": 0, "rows": {}}
+        if not os.path.exists(self.meta_path):
+            return empty
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        # Another model's vectors are not comparable: start over
+        if meta.get("model") != self.model_name:
+            old = os.path.join(self.index_dir, meta["file"])
+            if os.path.exists(old):
+                os.remove(old)
+            return empty
+        return meta
+
+    def _save_meta(self):
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.meta_path)
+
+    @property
+    def data_path(self):
+        return os.path.join(self.index_dir, self.meta["file"])
+
+    def matrix(self):
+        """All rows (live and stale), memory-mapped."""
+        if not self.meta["count"]:
+            return np.zeros((0, self.meta["dim"] or 0), np.float32)
+        return np.memmap(
+            self.data_path, dtype=np.float32, mode="r",
+            shape=(self.meta["count"], self.meta["dim"])
+        )
+
+    def update(self, texts, embedder):
+        """Indexes ``texts``; returns the matrix row of each, in order.
+
+        ``embedder(list_of_texts)`` must return normalized float32 vectors.
+        """
+        hashes = [text_hash(t) for t in texts]
+        rows = self.meta["rows"]
+
+        todo = {}
+        for h, t in zip(hashes, texts):
+            if h not in rows:
+                todo.setdefault(h, t)
+
+        if todo:
+            vectors = np.asarray(embedder(list(todo.values())), dtype=np.float32)
+            self._append(list(todo), vectors)
+
+        live = set(hashes)
+        if len(rows) > 2 * len(live):
+            self._compact(live)
+
+        # Compaction renumbers the rows
+        rows = self.meta["rows"]
+        return np.array([rows[h] for h in hashes], dtype=np.int64)
+
+    def _append(self, hashes, vectors):
+        os.makedirs(self.index_dir, exist_ok=True)
+        meta = self.meta
+        if meta["dim"] is None:
+            meta["dim"] = int(vectors.shape[1])
+
+        with open(self.data_path, "ab") as f:
+            # Rows past meta's count are from an interrupted update
+            f.truncate(meta["count"] * meta["dim"] * 4)
+            f.write(np.ascontiguousarray(vectors).tobytes())
+
+        for i, h in enumerate(hashes):
+            meta["rows"][h] = meta["count"] + i
+        meta["count"] += len(hashes)
+        self._save_meta()
+
+    def _compact(self, live):
+        matrix = self.matrix()
+        keep = sorted((row, h) for h, row in self.meta["rows"].items() if h in live)
+
+        old = self.data_path
+        generation = int(self.meta["file"].split("-")[1].split(".")[0]) + 1
+        self.meta["file"] = f"embeddings-{generation}.f32"
+        with open(self.data_path, "wb") as f:
+            for row, _ in keep:
+                f.write(np.asarray(matrix[row]).tobytes())
+        del matrix
+
+        self.meta["rows"] = {h: i for i, (_, h) in enumerate(keep)}
+        self.meta["count"] = len(keep)
+        self._save_meta()
+        os.remove(old)
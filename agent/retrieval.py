@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+# retrieval.py
+# Top-k retrieval over docindex.py embeddings for answer.py.
+#
+# Backends:
+#   exact - blockwise dot product against the memory-mapped matrix
+#   ivf   - IVF-flat: spherical k-means lists, NumPy only
+#   hnsw  - hnswlib graph (optional, `pip install hnswlib`)
+#
+# ANN indexes are built offline and saved under the doc index directory:
+#   python agent/retrieval.py build [ivf|hnsw]
+# They record which documents they were built for; answer.py falls back to
+# exact search when the documents have changed since, or when the corpus is
+# small enough that exact search is as fast.
+#
+# Recall@k and latency against exact search, on synthetic clustered vectors:
+#   python agent/retrieval.py bench [n_docs] [k] [backend,...]
+
+import os
+import sys
+import json
+import time
+import hashlib
+import numpy as np
+
+# ---------------- CONFIG ----------------
+
+# Up to this many documents exact search is used even if an ANN index exists
+EXACT_MAX_DOCS = int(os.environ.get("RETRIEVAL_EXACT_MAX_DOCS", "20000"))
+IVF_NPROBE = int(os.environ.get("RETRIEVAL_IVF_NPROBE", "16"))
+IVF_ITERS = 10
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF = int(os.environ.get("RETRIEVAL_HNSW_EF", "64"))
+BLOCK_ROWS = 65536  # rows scored per matmul, bounds the temporary score arrays
+
+# ---------------- HELPERS ----------------
+
+
+def docs_digest(hashes):
+    # Identifies the document list an ANN index was built for
+    return hashlib.sha256("\n".join(hashes).encode()).hexdigest()
+
+
+def top_k(scores, k):
+    k = min(k, len(scores))
+    if k == 0:
+        return np.zeros(0, np.int64)
+    ids = np.argpartition(-scores, k - 1)[:k]
+    return ids[np.argsort(-scores[ids], kind="stable")]
+
+
+def as_hits(ids, scores):
+    # util.semantic_search's per-query shape
+    return [{"corpus_id": int(i), "score": float(s)} for i, s in zip(ids, scores)]
+
+
+# ---------------- EXACT ----------------
+
+
+class ExactBackend:
+    """Brute-force inner product; vectors may be a memmap of any size."""
+
+    name = "exact"
+
+    def __init__(self, vectors, rows=None):
+        # rows: matrix row of each corpus id, when the matrix holds more
+        self.vectors = vectors
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows) if self.rows is not None else len(self.vectors)
+
+    def search(self, query, k):
+        query = np.asarray(query, np.float32)
+        scores = np.empty(len(self.vectors), np.float32)
+        for lo in range(0, len(self.vectors), BLOCK_ROWS):
+            scores[lo:lo + BLOCK_ROWS] = self.vectors[lo:lo + BLOCK_ROWS] @ query
+        if self.rows is not None:
+            scores = scores[self.rows]
+        ids = top_k(scores, k)
+        return as_hits(ids, scores[ids])
+
+
+# ---------------- IVF-FLAT ----------------
+
+
+def spherical_kmeans(vectors, nlist, iters=IVF_ITERS, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = nearest(vectors, centroids)
+        counts = np.bincount(assign, minlength=nlist)
+        # Per-list sums over the vectors grouped by list
+        grouped = vectors[np.argsort(assign, kind="stable")]
+        starts = np.cumsum(counts) - counts
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(grouped, starts[filled])
+        # Empty lists are reseeded from random points
+        sums[~filled] = vectors[rng.choice(len(vectors), int((~filled).sum()))]
+        centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True).clip(1e-12)
+    return centroids.astype(np.float32)
+
+
+def nearest(vectors, centroids):
+    # Blocks of ~16M scores
+    block = max(1, (1 << 24) // len(centroids))
+    assign = np.empty(len(vectors), np.int64)
+    for lo in range(0, len(vectors), block):
+        assign[lo:lo + block] = np.argmax(vectors[lo:lo + block] @ centroids.T, axis=1)
+    return assign
+
+
+class IVFBackend:
+    """Vectors grouped by nearest centroid; a query scans ``nprobe`` lists.
+
+    Each list's vectors are stored contiguously (a reordered copy), so a
+    probe is one slice of a memmap and one matmul.
+    """
+
+    name = "ivf"
+
+    def __init__(self, centroids, vectors, ids, offsets, nprobe=IVF_NPROBE):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, vectors, nlist=None, seed=0):
+        n = len(vectors)
+        nlist = nlist or max(1, min(n, int(4 * np.sqrt(n))))
+        # k-means on a sample; 64 points a list is plenty for the centroids
+        rng = np.random.default_rng(seed)
+        sample = vectors[np.sort(rng.choice(n, min(n, 64 * nlist), replace=False))]
+        centroids = spherical_kmeans(np.asarray(sample, np.float32), nlist, seed=seed)
+
+        assign = nearest(vectors, centroids)
+        ids = np.argsort(assign, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))])
+        return cls(centroids, np.asarray(vectors[ids], np.float32), ids, offsets)
+
+    def search(self, query, k):
+        query = np.asarray(query, np.float32)
+        probe = top_k(self.centroids @ query, self.nprobe)
+        spans = [(self.offsets[c], self.offsets[c + 1]) for c in probe]
+        pos = np.concatenate([np.arange(lo, hi) for lo, hi in spans])
+        scores = np.concatenate([self.vectors[lo:hi] @ query for lo, hi in spans])
+        best = top_k(scores, k)
+        return as_hits(self.ids[pos[best]], scores[best])
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ("centroids", "vectors", "ids", "offsets"):
+            np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, path):
+        def part(name):
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+        return cls(np.asarray(part("centroids")), part("vectors"), np.asarray(part("ids")),
+                   np.asarray(part("offsets")))
+
+
+# ---------------- HNSW ----------------
+
+
+def _hnswlib():
+    try:
+        import hnswlib
+    except ImportError:
+        raise RuntimeError("The hnsw backend needs hnswlib: pip install hnswlib")
+    return hnswlib
+
+
+class HNSWBackend:
+    name = "hnsw"
+
+    def __init__(self, index, ef=HNSW_EF):
+        self.index = index
+        self.index.set_ef(ef)
+
+    def __len__(self):
+        return self.index.get_current_count()
+
+    @classmethod
+    def build(cls, vectors, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION):
+        index = _hnswlib().Index(space="ip", dim=vectors.shape[1])
+        index.init_index(max_elements=len(vectors), M=m, ef_construction=ef_construction)
+        for lo in range(0, len(vectors), BLOCK_ROWS):
+            block = np.asarray(vectors[lo:lo + BLOCK_ROWS], np.float32)
+            index.add_items(block, np.arange(lo, lo + len(block)))
+        return cls(index)
+
+    def search(self, query, k):
+        labels, distances = self.index.knn_query(np.asarray(query, np.float32), k=min(k, len(self)))
+        # "ip" distance is 1 - inner product
+        return as_hits(labels[0], 1 - distances[0])
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.index.save_index(os.path.join(path, "hnsw.bin"))
+
+    @classmethod
+    def load(cls, path, dim):
+        index = _hnswlib().Index(space="ip", dim=dim)
+        index.load_index(os.path.join(path, "hnsw.bin"))
+        return cls(index)
+
+
+BACKENDS = {"ivf": IVFBackend, "hnsw": HNSWBackend}
+
+# ---------------- SAVED INDEXES ----------------
+
+
+def ann_dir(doc_index, kind):
+    return os.path.join(doc_index.index_dir, f"ann-{kind}")
+
+
+def build_saved(doc_index, hashes, rows, kind):
+    """Builds the ``kind`` index over the documents (in order) and saves it."""
+    vectors = doc_index.matrix()[rows]
+    t0 = time.perf_counter()
+    backend = BACKENDS[kind].build(vectors)
+    build_s = time.perf_counter() - t0
+
+    path = ann_dir(doc_index, kind)
+    backend.save(path)
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"docs": docs_digest(hashes), "count": len(rows), "dim": int(vectors.shape[1])}, f)
+    return backend, build_s
+
+
+def load_backend(doc_index, hashes, rows, kind="auto"):
+    """Backend for searching the documents ``hashes`` (matrix ``rows``)."""
+    exact = ExactBackend(doc_index.matrix(), rows)
+    if kind == "exact" or (kind == "auto" and len(rows) <= EXACT_MAX_DOCS):
+        return exact
+
+    for name in (BACKENDS if kind == "auto" else [kind]):
+        path = ann_dir(doc_index, name)
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["docs"] != docs_digest(hashes):
+            print(f"[WARN] {name} index is out of date, rebuild it with: python agent/retrieval.py build {name}")
+            continue
+        if name == "hnsw":
+            return HNSWBackend.load(path, meta["dim"])
+        return IVFBackend.load(path)
+
+    if kind != "auto":
+        print(f"[WARN] No usable {kind} index, using exact search")
+    return exact
+
+
+# ---------------- BENCH ----------------
+
+
+def clustered_vectors(n, dim=384, topics=None, seed=0):
+    # Normalized points around many topic centres, closer to sentence
+    # embeddings than uniform noise (on which no ANN index does well)
+    rng = np.random.default_rng(seed)
+    topics = topics or max(1, n // 200)
+    centres = rng.normal(size=(topics, dim)).astype(np.float32)
+    out = np.empty((n, dim), np.float32)
+    for lo in range(0, n, BLOCK_ROWS):
+        m = min(BLOCK_ROWS, n - lo)
+        out[lo:lo + m] = centres[rng.integers(topics, size=m)] + 0.6 * rng.normal(size=(m, dim))
+    out /= np.linalg.norm(out, axis=1, keepdims=True)
+    return out
+
+
+def latency_ms(backend, queries, k):
+    times, hits = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        hits.append(backend.search(q, k))
+        times.append((time.perf_counter() - t0) * 1000)
+    return hits, np.percentile(times, 50), np.percentile(times, 95)
+
+
+def recall(truth, hits, k):
+    found = sum(len({h["corpus_id"] for h in t} & {h["corpus_id"] for h in r}) for t, r in zip(truth, hits))
+    return found / (k * len(truth))
+
+
+def bench(n, k, kinds, n_queries=200):
+    vectors = clustered_vectors(n)
+    rng = np.random.default_rng(1)
+    # Queries near, not on, indexed documents
+    queries = vectors[rng.choice(n, n_queries, replace=False)] + 0.3 * rng.normal(size=(n_queries, vectors.shape[1]))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+    truth, p50, p95 = latency_ms(ExactBackend(vectors), queries, k)
+    print(f"[BENCH] {n} docs, {vectors.shape[1]} dims, {n_queries} queries, k={k}")
+    print(f"[BENCH] exact : p50 {p50:7.2f} ms  p95 {p95:7.2f} ms")
+
+    for kind in kinds:
+        t0 = time.perf_counter()
+        try:
+            backend = BACKENDS[kind].build(vectors)
+        except RuntimeError as e:
+            print(f"[BENCH] {kind:<5} : skipped ({e})")
+            continue
+        build_s = time.perf_counter() - t0
+        hits, p50_a, p95_a = latency_ms(backend, queries, k)
+        print(
+            f"[BENCH] {kind:<5} : p50 {p50_a:7.2f} ms  p95 {p95_a:7.2f} ms  "
+            f"x{p50 / p50_a:.1f}  recall@{k} {recall(truth, hits, k):.3f}  build {build_s:.1f}s"
+        )
+
+
+# ---------------- CLI ----------------
+
+
+def build_main(kind):
+    # Same documents and embeddings as answer.py
+    from sentence_transformers import SentenceTransformer
+    from docindex import DocIndex, text_hash, EMBED_MODEL, DOCS_PATH
+
+    with open(DOCS_PATH, "r", encoding="utf-8") as f:
+        texts = [d["text"] for d in json.load(f)]
+
+    embedder = SentenceTransformer(EMBED_MODEL)
+    index = DocIndex(EMBED_MODEL)
+    rows = index.update(texts, lambda t: embedder.encode(t, convert_to_numpy=True, normalize_embeddings=True))
+    _, build_s = build_saved(index, [text_hash(t) for t in texts], rows, kind)
+    print(f"{kind} index for {len(rows)} documents built in {build_s:.1f}s: {ann_dir(index, kind)}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    args = sys.argv[2:]
+    if command == "build":
+        build_main(args[0] if args else "ivf")
+    elif command == "bench":
+        bench(
+            int(args[0]) if args else 100_000,
+            int(args[1]) if len(args) > 1 else 10,
+            args[2].split(",") if len(args) > 2 else list(BACKENDS)
+        )
+    else:
+        raise SystemExit("Usage: python agent/retrieval.py build [ivf|hnsw] | bench [n_docs] [k] [backend,...]")
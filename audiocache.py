@@ -0,0 +1,153 @@
+# audiocache.py
+# Shared normalized-audio cache for vadspeaker.py and whisperagent.py.
+#
+# The source file is converted once to 16 kHz mono 16-bit PCM WAV and stored
+# under AUDIO_CACHE_DIR, keyed by the source's SHA-256. NeMo reads the WAV
+# path through its manifest; Whisper memory-maps the PCM samples directly.
+import os
+import hashlib
+import functools
+import mmap
+import tempfile
+import subprocess
+import numpy as np
+
+# =========================
+# CONFIG
+# =========================
+AUDIO_CACHE_DIR = os.environ.get("AUDIO_CACHE_DIR", ".audio_cache")  # "" = off
+AUDIO_CACHE_MAX_MB = int(os.environ.get("AUDIO_CACHE_MAX_MB", "4096"))
+SAMPLE_RATE = 16000
+RELEASE_ALIGN = max(mmap.PAGESIZE, 1 << 21)
+
+# =========================
+# HASHING
+# =========================
+@functools.lru_cache(maxsize=32)
+def _file_sha256(path, size, mtime_ns):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def file_sha256(path):
+    st = os.stat(path)
+    return _file_sha256(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+# =========================
+# CACHE
+# =========================
+def is_normalized(path, cache_dir=AUDIO_CACHE_DIR):
+    return bool(cache_dir) and \
+        os.path.dirname(os.path.abspath(path)) == os.path.abspath(cache_dir)
+
+def normalized_audio(path, cache_dir=AUDIO_CACHE_DIR):
+    """Path of the 16 kHz mono PCM WAV for ``path``, converting it on first use."""
+    if not cache_dir or is_normalized(path, cache_dir):
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    out = os.path.join(cache_dir, f"{file_sha256(path)[:32]}.wav")
+
+    if os.path.exists(out):
+        touch(out)
+        return out
+
+    print(f"[INFO] Normalizing {path} to {SAMPLE_RATE} Hz mono PCM")
+    # One temp file per writer: processes normalizing the same source must
+    # not write into each other's output. Not *.wav, so evict_lru skips it.
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        subprocess.run([
+            "ffmpeg", "-nostdin", "-y", "-v", "error",
+            "-i", path,
+            "-map_metadata", "-1", "-bitexact",
+            "-ac", "1", "-ar", str(SAMPLE_RATE), "-acodec", "pcm_s16le",
+            "-f", "wav", tmp
+        ], check=True)
+        os.replace(tmp, out)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    evict_lru(cache_dir, ".wav", AUDIO_CACHE_MAX_MB, keep=out, label="Audio cache")
+    return out
+
+def touch(path):
+    # Reads count as use for evict_lru, which orders by mtime
+    os.utime(path)
+
+def evict_lru(cache_dir, suffix, max_mb, keep=None, label="Cache"):
+    """Removes the least recently modified ``*suffix`` files in ``cache_dir``
+    until they total at most ``max_mb``. ``keep`` counts but is never removed.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith(suffix) and path != keep:
+            st = os.stat(path)
+            entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    if keep and os.path.exists(keep):
+        total += os.path.getsize(keep)
+
+    for _, size, path in sorted(entries):
+        if total <= max_mb * 1024 * 1024:
+            break
+        os.remove(path)
+        total -= size
+        print(f"[INFO] {label}: evicted {os.path.basename(path)}")
+
+# =========================
+# PCM ACCESS
+# =========================
+def read_pcm(wav_path):
+    """Memory-mapped int16 samples of a 16-bit PCM WAV (no copy, no decode)."""
+    with open(wav_path, "rb") as f:
+        if f.read(4) != b"RIFF" or f.read(8)[4:] != b"WAVE":
+            raise ValueError(f"{wav_path} is not a WAV file")
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{wav_path} has no data chunk")
+            chunk_id = header[:4]
+            size = int.from_bytes(header[4:], "little")
+            if chunk_id == b"data":
+                offset = f.tell()
+                break
+            f.seek(size + (size & 1), os.SEEK_CUR)
+
+    # ffmpeg may leave the size field at 0/0xFFFFFFFF when streaming
+    available = os.path.getsize(wav_path) - offset
+    if size == 0 or size > available:
+        size = available
+
+    return np.memmap(wav_path, dtype=np.int16, mode="r", offset=offset, shape=(size // 2,))
+
+def pcm_to_float(pcm):
+    # Same scaling as whisper.load_audio
+    return pcm.astype(np.float32) / 32768.0
+
+def release(pcm):
+    """Drop the resident pages behind a slice of a read_pcm() mapping.
+
+    The mapping is read-only and file-backed, so this only lowers RSS: the
+    samples are read back from the file if the slice is touched again.
+    """
+    mm = getattr(pcm, "_mmap", None)
+    if mm is None or not hasattr(mm, "madvise") or len(pcm) == 0:
+        return
+    base = np.frombuffer(mm, np.uint8, count=1).ctypes.data
+    # A fault maps more than the page it hit (fault-around, large page-cache
+    # folios of up to 2 MiB), so whole aligned windows around the slice go
+    start = pcm.ctypes.data
+    end = start + pcm.nbytes
+    start = max(base, start - start % RELEASE_ALIGN)
+    end = min(base + len(mm), end + -end % RELEASE_ALIGN)
+    mm.madvise(mmap.MADV_DONTNEED, start - base, end - start)
@@ -0,0 +1,266 @@
+# metrics.py
+# Lightweight run instrumentation shared by whisperagent.py, vadspeaker.py
+# and the wrappers around them.
+#
+# A run calls start(), wraps its stages in span(...), and finish(path)
+# writes a metrics JSON: wall time, calls, peak RSS and audio seconds /
+# real-time factor per stage. Spans with the same name are aggregated, so
+# per-chunk spans add up to one "transcribe" entry. With no active run,
+# span() costs nothing.
+#
+# WHISPER_PROFILE=cprofile dumps <metrics>.prof (pstats/snakeviz, main
+# thread only); WHISPER_PROFILE=py-spy records <metrics>.speedscope.json
+# with an attached py-spy (all threads, needs py-spy on PATH).
+import os
+import sys
+import json
+import time
+import signal
+import threading
+import contextlib
+import subprocess
+import cProfile
+import resource
+
+# =========================
+# CONFIG
+# =========================
+PROFILE = os.environ.get("WHISPER_PROFILE", "")  # "" | "cprofile" | "py-spy"
+
+# =========================
+# RSS
+# =========================
+def _status_kb(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def peak_rss_kb():
+    hwm = _status_kb("VmHWM:")
+    return hwm if hwm is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _reset_peak():
+    # Linux >= 4.0: "5" resets VmHWM to the current RSS. Elsewhere the
+    # peak stays the process-wide one.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+# =========================
+# COLLECTOR
+# =========================
+class Metrics:
+    """Aggregated spans for one run.
+
+    Spans may be open on several threads at once. RSS is process-wide, so
+    before the high-water mark is reset for a new span it is folded into
+    every span that is still open; each span therefore reports the true
+    peak over its own lifetime.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.stages = {}
+        self.info = {}
+        # Resetting VmHWM also resets ru_maxrss, so the run's peak is kept here
+        self.peak_kb = peak_rss_kb()
+        self._open = []
+        self._lock = threading.Lock()
+
+    def _fold(self):
+        peak = peak_rss_kb()
+        self.peak_kb = max(self.peak_kb, peak)
+        for s in self._open:
+            s["peak_kb"] = max(s["peak_kb"], peak)
+
+    def begin(self, name, audio_seconds=None):
+        with self._lock:
+            self._fold()
+            _reset_peak()
+            span = {
+                "name": name,
+                "audio_seconds": audio_seconds,
+                "peak_kb": peak_rss_kb(),
+                "t0": time.perf_counter()
+            }
+            self._open.append(span)
+            return span
+
+    def end(self, span):
+        seconds = time.perf_counter() - span["t0"]
+        with self._lock:
+            self._fold()
+            self._open.remove(span)
+            self._add(span["name"], seconds, span["audio_seconds"], span["peak_kb"])
+
+    def _add(self, name, seconds, audio_seconds=None, peak_kb=None):
+        stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+        stage["seconds"] += seconds
+        stage["calls"] += 1
+        if audio_seconds:
+            stage["audio_seconds"] = stage.get("audio_seconds", 0.0) + audio_seconds
+        if peak_kb is not None:
+            stage["peak_rss_mb"] = max(stage.get("peak_rss_mb", 0.0), peak_kb / 1024)
+
+    def add(self, name, seconds, audio_seconds=None):
+        # For time measured elsewhere (pipeline stages, a child process)
+        with self._lock:
+            self._add(name, seconds, audio_seconds)
+
+    @contextlib.contextmanager
+    def span(self, name, audio_seconds=None):
+        span = self.begin(name, audio_seconds)
+        try:
+            yield
+        finally:
+            self.end(span)
+
+    def summary(self):
+        wall = time.perf_counter() - self.t0
+        stages = {}
+        for name, stage in self.stages.items():
+            stage = dict(stage, seconds=round(stage["seconds"], 4))
+            if stage.get("audio_seconds"):
+                stage["audio_seconds"] = round(stage["audio_seconds"], 2)
+                stage["rtf"] = round(stage["seconds"] / stage["audio_seconds"], 4)
+            if "peak_rss_mb" in stage:
+                stage["peak_rss_mb"] = round(stage["peak_rss_mb"], 1)
+            stages[name] = stage
+
+        out = {
+            "name": self.name,
+            "started": self.started,
+            "wall_seconds": round(wall, 3),
+            "peak_rss_mb": round(max(self.peak_kb, peak_rss_kb()) / 1024, 1),
+            **self.info,
+            "stages": stages
+        }
+        if self.info.get("audio_seconds"):
+            out["rtf"] = round(wall / self.info["audio_seconds"], 4)
+        return out
+
+    def report(self):
+        summary = self.summary()
+        for name, s in summary["stages"].items():
+            line = f"[METRICS] {name:<14} {s['seconds']:9.2f}s  calls {s['calls']:6d}"
+            if "rtf" in s:
+                line += f"  RTF {s['rtf']:.3f}"
+            if "peak_rss_mb" in s:
+                line += f"  peak {s['peak_rss_mb']:.0f} MB"
+            print(line)
+        line = f"[METRICS] {'total':<14} {summary['wall_seconds']:9.2f}s"
+        if "rtf" in summary:
+            line += f"  RTF {summary['rtf']:.3f}"
+        print(line + f"  peak {summary['peak_rss_mb']:.0f} MB")
+
+# =========================
+# PROFILING HOOK
+# =========================
+class _Profiler:
+    def __init__(self, mode):
+        self.mode = mode
+        self.prof = None
+        self.proc = None
+        self.tmp = f"profile-{os.getpid()}.speedscope.json"
+
+        if mode == "cprofile":
+            self.prof = cProfile.Profile()
+            self.prof.enable()
+        elif mode == "py-spy":
+            try:
+                self.proc = subprocess.Popen([
+                    "py-spy", "record", "--pid", str(os.getpid()),
+                    "--format", "speedscope", "--output", self.tmp
+                ], stdout=subprocess.DEVNULL)
+            except FileNotFoundError:
+                print("[WARN] WHISPER_PROFILE=py-spy but py-spy is not installed")
+        elif mode:
+            print(f"[WARN] Unknown WHISPER_PROFILE={mode!r}, profiling is off")
+
+    def stop(self, base):
+        if self.prof is not None:
+            self.prof.disable()
+            self.prof.dump_stats(base + ".prof")
+            print(f"[INFO] Profile written to {base}.prof")
+        if self.proc is not None:
+            # py-spy writes its output when interrupted
+            self.proc.send_signal(signal.SIGINT)
+            self.proc.wait()
+            if os.path.exists(self.tmp):
+                os.replace(self.tmp, base + ".speedscope.json")
+                print(f"[INFO] Profile written to {base}.speedscope.json")
+
+# =========================
+# ACTIVE RUN
+# =========================
+_active = None
+_profiler = None
+
+def start(name=None):
+    global _active, _profiler
+    _active = Metrics(name or os.path.basename(sys.argv[0]))
+    if PROFILE and _profiler is None:
+        _profiler = _Profiler(PROFILE)
+    return _active
+
+def active():
+    return _active
+
+def span(name, audio_seconds=None):
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.span(name, audio_seconds)
+
+def add(name, seconds, audio_seconds=None):
+    if _active is not None:
+        _active.add(name, seconds, audio_seconds)
+
+def note(key, value):
+    if _active is not None:
+        _active.info[key] = value
+
+def time_module(module, name):
+    """Times every forward() of a torch module as span ``name``.
+
+    Returns the hook handles; call .remove() on each when done.
+    """
+    spans = []
+
+    def pre(mod, inputs):
+        if _active is not None:
+            spans.append((_active, _active.begin(name)))
+
+    def post(mod, inputs, output):
+        if spans:
+            metrics, s = spans.pop()
+            metrics.end(s)
+
+    return [module.register_forward_pre_hook(pre), module.register_forward_hook(post)]
+
+def finish(path):
+    """Writes the active run's metrics to ``path`` and ends the run."""
+    global _active, _profiler
+    if _active is None:
+        return None
+
+    summary = _active.summary()
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+    _active.report()
+    print(f"[INFO] Metrics written to {path}")
+
+    if _profiler is not None:
+        _profiler.stop(os.path.splitext(path)[0])
+        _profiler = None
+    _active = None
+    return summary
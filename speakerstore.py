@@ -0,0 +1,235 @@
+# speakerstore.py
+# Speaker turns shared by vadspeaker.py (writer) and whisperagent.py (reader).
+#
+# Turns live in NumPy arrays sorted by start (start, end, speaker id) plus a
+# label table, ~18 bytes a turn. speakers.json stays the interchange format;
+# beside it goes speakers.npz with the same turns, which loads without any
+# JSON parsing. The NPZ records the size and mtime of the JSON it was made
+# from; load() uses it only while those still match, and rewrites it from
+# the JSON otherwise. A copied-in JSON with a preserved old mtime still
+# differs from the one the NPZ came from.
+import os
+import json
+import hashlib
+import textwrap
+from array import array
+import numpy as np
+
+# =========================
+# SEGMENTS
+# =========================
+class SpeakerSegments:
+    """Speaker turns as sorted arrays.
+
+    Iterating yields the speakers.json rows ({"speaker", "start", "end"}),
+    so code written against the list of dicts keeps working; the array
+    methods are the fast paths.
+    """
+
+    def __init__(self, starts, ends, speaker_ids, labels):
+        # Stable, so equal starts keep their input order
+        order = np.argsort(starts, kind="stable")
+        self.starts = np.asarray(starts, np.float64)[order]
+        self.ends = np.asarray(ends, np.float64)[order]
+        self.speaker_ids = np.asarray(speaker_ids, np.uint16)[order]
+        self.labels = list(labels)
+        # (size, mtime_ns) of the speakers.json an NPZ was made from
+        self.source = None
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [])
+
+    @classmethod
+    def from_turns(cls, turns):
+        return cls._build((t["start"], t["end"], t["speaker"]) for t in turns)
+
+    @classmethod
+    def from_rttm(cls, path):
+        return cls._build(iter_rttm(path))
+
+    @classmethod
+    def _build(cls, rows):
+        starts, ends, ids = array("d"), array("d"), array("H")
+        label_ids = {}
+        for start, end, speaker in rows:
+            starts.append(start)
+            ends.append(end)
+            ids.append(label_ids.setdefault(speaker, len(label_ids)))
+        return cls(
+            np.frombuffer(starts, np.float64),
+            np.frombuffer(ends, np.float64),
+            np.frombuffer(ids, np.uint16),
+            label_ids
+        )
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        for start, end, i in zip(self.starts.tolist(), self.ends.tolist(), self.speaker_ids.tolist()):
+            yield {"speaker": self.labels[i], "start": start, "end": end}
+
+    def speakers(self):
+        # Label per turn
+        return np.array(self.labels, dtype=object)[self.speaker_ids].tolist()
+
+    def spans(self):
+        return list(zip(self.starts.tolist(), self.ends.tolist()))
+
+    def window(self, start, end):
+        """Turns overlapping [start, end), in window-relative seconds."""
+        keep = (self.ends > start) & (self.starts < end)
+        out = SpeakerSegments.empty()
+        out.starts = self.starts[keep] - start
+        out.ends = self.ends[keep] - start
+        out.speaker_ids = self.speaker_ids[keep]
+        out.labels = self.labels
+        return out
+
+    def digest(self):
+        h = hashlib.sha256()
+        for a in (self.starts, self.ends, self.speaker_ids):
+            h.update(a.tobytes())
+        h.update(json.dumps(self.labels).encode())
+        return h.hexdigest()
+
+    def save(self, path, source=None):
+        # Through a temp file: a reader must never see a partial NPZ
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            starts=self.starts,
+            ends=self.ends,
+            speaker_ids=self.speaker_ids,
+            labels=np.array(self.labels, dtype=str),
+            source=np.array(source if source is not None else [], np.int64)
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as z:
+            out = cls.empty()
+            # Saved sorted, so no re-sort
+            out.starts = z["starts"]
+            out.ends = z["ends"]
+            out.speaker_ids = z["speaker_ids"]
+            out.labels = z["labels"].tolist()
+            out.source = z["source"].tolist() if "source" in z.files else None
+        return out
+
+def as_segments(speakers):
+    # Callers may still hand over speakers.json rows
+    if isinstance(speakers, SpeakerSegments):
+        return speakers
+    return SpeakerSegments.from_turns(speakers or [])
+
+# =========================
+# RTTM
+# =========================
+def iter_rttm(path):
+    # SPEAKER <file> <chan> <start> <duration> <NA> <NA> <speaker> ...
+    with open(path) as f:
+        for line in f:
+            p = line.split()
+            if p:
+                start = float(p[3])
+                yield start, start + float(p[4]), p[7]
+
+# =========================
+# FILES
+# =========================
+def npz_path(json_path):
+    return os.path.splitext(json_path)[0] + ".npz"
+
+def fingerprint(json_path):
+    st = os.stat(json_path)
+    return [st.st_size, st.st_mtime_ns]
+
+def exists(json_path):
+    return os.path.exists(json_path) or os.path.exists(npz_path(json_path))
+
+def load(json_path):
+    """SpeakerSegments for speakers.json, from the NPZ beside it when it
+    was made from this JSON."""
+    npz = npz_path(json_path)
+    if not os.path.exists(json_path):
+        return SpeakerSegments.load(npz)
+
+    source = fingerprint(json_path)
+    if os.path.exists(npz):
+        segments = SpeakerSegments.load(npz)
+        if segments.source == source:
+            return segments
+
+    with open(json_path) as f:
+        segments = SpeakerSegments.from_turns(json.load(f))
+    try:
+        segments.save(npz, source)
+    except OSError:
+        pass
+    return segments
+
+def write(segments, json_path):
+    with open(json_path, "w") as f:
+        json.dump(list(segments), f, indent=2)
+    segments.save(npz_path(json_path), fingerprint(json_path))
+
+def remove(json_path):
+    for path in (json_path, npz_path(json_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+class TurnWriter:
+    """Writes speakers.json one turn at a time, then the NPZ on close.
+
+    The JSON is the same array write() produces, flushed turn by turn; a
+    turn is held back only until the next one shows whether it continues
+    it (same speaker, gap up to join_gap).
+    """
+
+    def __init__(self, path, join_gap=0.0):
+        self.path = path
+        self.join_gap = join_gap
+        self.count = 0
+        self._pending = None
+        self._starts, self._ends, self._speakers = array("d"), array("d"), []
+
+    def __enter__(self):
+        self.f = open(self.path, "w")
+        self.f.write("[")
+        return self
+
+    def write(self, turn):
+        p = self._pending
+        if p and p["speaker"] == turn["speaker"] and turn["start"] - p["end"] <= self.join_gap:
+            p["end"] = max(p["end"], turn["end"])
+            return
+        self._flush()
+        self._pending = dict(turn)
+
+    def _flush(self):
+        p = self._pending
+        if p is None:
+            return
+        sep = "," if self.count else ""
+        self.f.write(sep + "\n" + textwrap.indent(json.dumps(p, indent=2), "  "))
+        self.f.flush()
+        self.count += 1
+        self._starts.append(p["start"])
+        self._ends.append(p["end"])
+        self._speakers.append(p["speaker"])
+        self._pending = None
+
+    def __exit__(self, exc_type, *exc):
+        self._flush()
+        self.f.write("\n]" if self.count else "]")
+        self.f.close()
+        # No NPZ for a failed run: load() would prefer it to the JSON
+        if exc_type is not None:
+            return
+        SpeakerSegments.from_turns(
+            {"start": s, "end": e, "speaker": k}
+            for s, e, k in zip(self._starts, self._ends, self._speakers)
+        ).save(npz_path(self.path), fingerprint(self.path))
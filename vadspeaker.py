@@ -1,87 +1,527 @@
 # vadspeaker.py
-import sys
+# NeMo clustering diarization: MarbleNet VAD, ECAPA-TDNN embeddings.
+#
+# Usage: python vadspeaker.py <audio_path> [<audio_path> ...]
+#
+# One file writes speakers.json, which whisperagent.py reads. Several files
+# are diarized in a single NeMo run, with the models loaded once, and each
+# gets <audio stem>.speakers.json beside it, which whisperbatch.py reads.
+# Each JSON gets a speakers.npz twin (see speakerstore.py).
+#
+#   python vadspeaker.py --profile fast <audio_path> ...
+#   python vadspeaker.py --max-speakers 4 <audio_path> ...
+#   python vadspeaker.py --recluster --num-speakers 2 <audio_path> ...
+#   python vadspeaker.py --window 600 <audio_path> ...
+#
+# VAD output and speaker embeddings are cached per audio content (and
+# VAD/embedding settings) under DIARIZE_CACHE_DIR. A rerun with other
+# clustering settings only re-clusters; --recluster insists on that and
+# fails instead of loading the models.
+#
+# --window (or DIARIZE_WINDOW_SECONDS) diarizes long recordings in fixed
+# windows: NeMo's clustering is quadratic in the number of embeddings, so a
+# whole multi-hour file is slow and large. Speakers are linked across
+# windows through running embedding centroids, and turns are streamed to
+# the output JSON as each window finishes.
+#
+# From Python:
+#   diarize(paths) -> {path: SpeakerSegments}, which iterates as
+#   [{"speaker", "start", "end"}, ...]
+#   Diarizer().run(paths) keeps the models loaded between calls.
+#   recluster(paths, max_num_speakers=4) uses cached embeddings only.
+import os
 import json
+import wave
+import hashlib
+import argparse
+import numpy as np
+import torch
 from omegaconf import OmegaConf
 from nemo.collections.asr.models import ClusteringDiarizer
-
-audio_path = sys.argv[1]
-output_json = "speakers.json"
+from nemo.collections.asr.parts.utils.speaker_utils import (
+    audio_rttm_map, get_embs_and_timestamps, perform_clustering
+)
+from audiocache import normalized_audio, is_normalized, read_pcm, release, file_sha256, touch, evict_lru, SAMPLE_RATE, AUDIO_CACHE_DIR
+from speakerstore import SpeakerSegments, TurnWriter
+import speakerstore
+import metrics
 
 # -------------------------
-# Manifest
+# Config
 # -------------------------
-with open("manifest.json", "w") as f:
-    f.write(json.dumps({
-        "audio_filepath": audio_path,
-        "offset": 0,
-        "duration": None,
-        "label": "infer",
-        "text": "-"
-    }) + "\n")
-
-# -------------------------
-# STRICT NeMo config
-# -------------------------
-cfg = OmegaConf.create({
-    "device": "cpu",
-
-    "diarizer": {
-        "manifest_filepath": "manifest.json",
-        "out_dir": "nemo_diar",
-
-        "oracle_vad": False,
-
-        "vad": {
-            "model_path": "vad_telephony_marblenet",
-            "parameters": {
-                "window_length_in_sec": 0.15,
-                "shift_length_in_sec": 0.01,
-                "smoothing": "median",
-                "overlap": 0.5,
-                "onset": 0.8,
-                "offset": 0.6,
-                "min_duration_on": 0.1,
-                "min_duration_off": 0.1
-            }
-        },
+OUTPUT_JSON = "speakers.json"
+METRICS_JSON = "speakers.metrics.json"
+MANIFEST_PATH = "manifest.json"
+OUT_DIR = "nemo_diar"
 
-        "speaker_embeddings": {
-            "model_path": "ecapa_tdnn",
-            "parameters": {
-                "window_length_in_sec": 1.5,
-                "shift_length_in_sec": 0.75
-            }
-        },
+# VAD frame shift and the embedding grid set most of the CPU time: a 10 ms
+# VAD shift and 0.75 s embedding shift mean 100 VAD frames and ~1.3
+# embeddings per second of audio. "balanced" is the original config;
+# `python whisperbench.py diarize` reports DER and wall time per profile.
+# threads is torch's intra-op thread count (0 = torch's default, all
+# cores); fast leaves cores to a Whisper run beside it. An OMP_NUM_THREADS
+# set by the caller (whisperdiarize.py) takes precedence.
+PROFILES = {
+    "fast": {
+        "vad_shift": 0.04,
+        "window": 3.0,
+        "shift": 1.5,
+        "batch_size": 128,
+        "threads": 2
+    },
+    "balanced": {
+        "vad_shift": 0.01,
+        "window": 1.5,
+        "shift": 0.75,
+        "batch_size": 64,
+        "threads": 0
+    },
+    # Multiscale embeddings, as in NeMo's telephonic inference config
+    "accurate": {
+        "vad_shift": 0.01,
+        "window": [1.5, 1.25, 1.0, 0.75, 0.5],
+        "shift": [0.75, 0.625, 0.5, 0.375, 0.25],
+        "weights": [1, 1, 1, 1, 1],
+        "batch_size": 64,
+        "threads": 0
+    }
+}
+PROFILE = os.environ.get("DIARIZE_PROFILE", "balanced")
+DEFAULT_THREADS = torch.get_num_threads()
+
+# Windowed mode (0 = whole file). A window speaker joins the closest known
+# speaker when their centroids' cosine similarity reaches LINK_THRESHOLD.
+DIARIZE_WINDOW_SECONDS = float(os.environ.get("DIARIZE_WINDOW_SECONDS", "0"))
+LINK_THRESHOLD = float(os.environ.get("DIARIZE_LINK_THRESHOLD", "0.6"))
+# Same-speaker turns split by a window edge are joined across gaps up to this
+JOIN_GAP = 0.5
+
+# VAD + embedding cache ("" = off), LRU-evicted down to DIARIZE_CACHE_MAX_MB
+DIARIZE_CACHE_DIR = os.environ.get("DIARIZE_CACHE_DIR", ".diarize_cache")
+DIARIZE_CACHE_MAX_MB = int(os.environ.get("DIARIZE_CACHE_MAX_MB", "1024"))
+
+# STRICT NeMo config; clustering overrides e.g. {"max_num_speakers": 4}
+def build_config(manifest_path=MANIFEST_PATH, out_dir=OUT_DIR, clustering=None,
+                 num_speakers=None, profile=PROFILE):
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown diarization profile {profile!r}, expected one of {sorted(PROFILES)}")
+    p = PROFILES[profile]
+
+    cfg = OmegaConf.create({
+        "device": "cpu",
+        "batch_size": p["batch_size"],
+        # Threads come from the profile (Diarizer.load); no loader processes
+        "num_workers": 0,
 
-        "clustering": {
-            "parameters": {
-                "oracle_num_speakers": False,
-                "max_num_speakers": 8
+        "diarizer": {
+            "manifest_filepath": manifest_path,
+            "out_dir": out_dir,
+
+            "oracle_vad": False,
+
+            "vad": {
+                "model_path": "vad_telephony_marblenet",
+                "parameters": {
+                    "window_length_in_sec": 0.15,
+                    "shift_length_in_sec": p["vad_shift"],
+                    "smoothing": "median",
+                    "overlap": 0.5,
+                    "onset": 0.8,
+                    "offset": 0.6,
+                    "min_duration_on": 0.1,
+                    "min_duration_off": 0.1
+                }
+            },
+
+            "speaker_embeddings": {
+                "model_path": "ecapa_tdnn",
+                "parameters": {
+                    "window_length_in_sec": p["window"],
+                    "shift_length_in_sec": p["shift"]
+                }
+            },
+
+            "clustering": {
+                "parameters": {
+                    "oracle_num_speakers": False,
+                    "max_num_speakers": 8
+                }
             }
         }
+    })
+    if "weights" in p:
+        cfg.diarizer.speaker_embeddings.parameters.multiscale_weights = p["weights"]
+    if clustering:
+        cfg.diarizer.clustering.parameters = OmegaConf.merge(
+            cfg.diarizer.clustering.parameters, clustering
+        )
+    if num_speakers:
+        # The count itself goes into the manifest
+        cfg.diarizer.clustering.parameters.oracle_num_speakers = True
+    return cfg
+
+# -------------------------
+# Manifest
+# -------------------------
+def uniq_id(audio_path):
+    # NeMo names each file's RTTM after the audio basename
+    return os.path.splitext(os.path.basename(audio_path))[0]
+
+def write_manifest(audio_paths, manifest_path=MANIFEST_PATH, num_speakers=None):
+    # num_speakers is read by NeMo only with oracle_num_speakers
+    with open(manifest_path, "w") as f:
+        for path in audio_paths:
+            f.write(json.dumps({
+                "audio_filepath": path,
+                "offset": 0,
+                "duration": None,
+                "label": "infer",
+                "text": "-",
+                "num_speakers": num_speakers
+            }) + "\n")
+
+def audio_seconds(paths):
+    # Only known without a decode for cache WAVs
+    if not all(is_normalized(p) for p in paths):
+        return None
+    return sum(len(read_pcm(p)) for p in paths) / SAMPLE_RATE
+
+# -------------------------
+# RTTM → segments
+# -------------------------
+def parse_rttm(path):
+    return SpeakerSegments.from_rttm(path)
+
+# -------------------------
+# VAD + embedding cache
+# -------------------------
+def cache_key(cfg):
+    # Everything upstream of clustering
+    params = {
+        "vad": OmegaConf.to_container(cfg.diarizer.vad, resolve=True),
+        "embeddings": OmegaConf.to_container(cfg.diarizer.speaker_embeddings, resolve=True),
     }
-})
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+def cache_path(wav, cfg, cache_dir=DIARIZE_CACHE_DIR):
+    return os.path.join(cache_dir, f"{file_sha256(wav)[:32]}-{cache_key(cfg)}.pt")
+
+def speech_segments(model):
+    # VAD output: the speech-segment manifest NeMo embeds from, per uniq_id
+    speech = {}
+    path = getattr(model, "_speaker_manifest_path", None)
+    if not path or not os.path.exists(path):
+        return speech
+    with open(path) as f:
+        for line in f:
+            rec = json.loads(line)
+            start = float(rec["offset"])
+            speech.setdefault(uniq_id(rec["audio_filepath"]), []).append(
+                (start, start + float(rec["duration"]))
+            )
+    return speech
 
-print("[INFO] Running NeMo diarization...")
-diarizer = ClusteringDiarizer(cfg=cfg)
-diarizer.diarize()
+def save_cached(model, wavs, cfg, cache_dir=DIARIZE_CACHE_DIR):
+    embs = get_embs_and_timestamps(model.multiscale_embeddings_and_timestamps, model.multiscale_args_dict)
+    speech = speech_segments(model)
+    os.makedirs(cache_dir, exist_ok=True)
+    for wav in wavs:
+        path = cache_path(wav, cfg, cache_dir)
+        tmp = path + ".tmp"
+        torch.save({"embs": embs[uniq_id(wav)], "speech": speech.get(uniq_id(wav), [])}, tmp)
+        os.replace(tmp, path)
+    evict_lru(cache_dir, ".pt", DIARIZE_CACHE_MAX_MB, label="Diarize cache")
+
+def load_cached(wav, cfg, cache_dir=DIARIZE_CACHE_DIR):
+    path = cache_path(wav, cfg, cache_dir)
+    if not cache_dir or not os.path.exists(path):
+        return None
+    touch(path)
+    return torch.load(path, map_location="cpu")
+
+def cluster_cached(cached, cfg, manifest_path, out_dir, num_speakers=None):
+    """Clustering only, from cached embeddings: {wav: entry} -> {wav: segments}."""
+    wavs = list(cached)
+    write_manifest(wavs, manifest_path, num_speakers)
+
+    rttm_dir = os.path.join(out_dir, "pred_rttms")
+    os.makedirs(rttm_dir, exist_ok=True)
+    perform_clustering(
+        embs_and_timestamps={uniq_id(w): cached[w]["embs"] for w in wavs},
+        AUDIO_RTTM_MAP=audio_rttm_map(manifest_path),
+        out_rttm_dir=rttm_dir,
+        clustering_params=cfg.diarizer.clustering.parameters,
+        device=torch.device("cpu"),
+        verbose=False
+    )
+    return {w: parse_rttm(os.path.join(rttm_dir, f"{uniq_id(w)}.rttm")) for w in wavs}
 
 # -------------------------
-# RTTM → JSON
+# Diarization
 # -------------------------
-rttm = "nemo_diar/pred_rttms/manifest.rttm"
-segments = []
+class Diarizer:
+    """ClusteringDiarizer whose VAD and speaker models are loaded once.
+
+    Each run() writes one manifest for all of its files, so NeMo handles
+    them in a single pass, and returns the segments per input path.
+    """
+
+    def __init__(self, manifest_path=MANIFEST_PATH, out_dir=OUT_DIR,
+                 clustering=None, num_speakers=None, cache_dir=DIARIZE_CACHE_DIR,
+                 profile=PROFILE):
+        self.manifest_path = manifest_path
+        self.out_dir = out_dir
+        self.cfg = build_config(manifest_path, out_dir, clustering, num_speakers, profile)
+        self.threads = PROFILES[profile]["threads"]
+        self.num_speakers = num_speakers
+        self.cache_dir = cache_dir
+        self.model = None
+
+    def run(self, audio_paths, recluster_only=False):
+        # 16 kHz mono PCM, shared with whisperagent.py through the audio cache
+        with metrics.span("ffmpeg"):
+            wavs = {path: normalized_audio(path) for path in audio_paths}
+
+        # Identical content maps to the same cache WAV and is diarized once
+        unique = list(dict.fromkeys(wavs.values()))
+        ids = [uniq_id(w) for w in unique]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Audio files must have distinct basenames (NeMo keys RTTMs by name)")
+
+        cached = {}
+        if self.cache_dir:
+            for w in unique:
+                entry = load_cached(w, self.cfg, self.cache_dir)
+                if entry is not None:
+                    cached[w] = entry
+        todo = [w for w in unique if w not in cached]
+        if todo and recluster_only:
+            raise RuntimeError(f"No cached VAD/embeddings for {todo}, run without --recluster first")
+
+        by_wav = {}
+        if todo:
+            by_wav.update(self._diarize(todo))
+        if cached:
+            print(f"[INFO] Re-clustering {len(cached)} file(s) from cached embeddings...")
+            with metrics.span("cluster", audio_seconds(list(cached))):
+                by_wav.update(cluster_cached(
+                    cached, self.cfg, self.manifest_path, self.out_dir, self.num_speakers
+                ))
+        return {path: by_wav[wav] for path, wav in wavs.items()}
+
+    def load(self):
+        # Needs a manifest on disk; run() writes the real one before diarizing
+        if self.model is None:
+            if not os.path.exists(self.manifest_path):
+                write_manifest([], self.manifest_path)
+            if not os.environ.get("OMP_NUM_THREADS"):
+                torch.set_num_threads(self.threads or DEFAULT_THREADS)
+            self.threads = torch.get_num_threads()
+            metrics.note("threads", self.threads)
+            print(f"[INFO] Loading NeMo VAD and speaker models ({self.threads} threads)...")
+            with metrics.span("model_load"):
+                self.model = ClusteringDiarizer(cfg=self.cfg)
+        return self.model
+
+    def run_windowed(self, audio_path, out, window_seconds=DIARIZE_WINDOW_SECONDS):
+        """Diarizes ``audio_path`` window by window into ``out`` (a TurnWriter).
+
+        Only one window's audio, embeddings and turns are held at a time;
+        across windows just the speaker centroids are kept.
+        """
+        if not AUDIO_CACHE_DIR:
+            raise RuntimeError("Windowed diarization needs AUDIO_CACHE_DIR for the PCM mapping")
+        with metrics.span("ffmpeg"):
+            pcm = read_pcm(normalized_audio(audio_path))
+        window_wav = os.path.join(self.out_dir, "window.wav")
+        window_rttm = os.path.join(self.out_dir, "pred_rttms", f"{uniq_id(window_wav)}.rttm")
+        os.makedirs(self.out_dir, exist_ok=True)
+        linker = SpeakerLinker()
+
+        for start, end in window_bounds(len(pcm), int(window_seconds * SAMPLE_RATE)):
+            view = pcm[start:end]
+            with metrics.span("window", len(view) / SAMPLE_RATE):
+                with wave.open(window_wav, "wb") as w:
+                    w.setnchannels(1)
+                    w.setsampwidth(2)
+                    w.setframerate(SAMPLE_RATE)
+                    w.writeframes(view.tobytes())
+                release(view)
+
+                # Every window reuses one name, so the last RTTM must not linger
+                if os.path.exists(window_rttm):
+                    os.remove(window_rttm)
+                try:
+                    turns = self._diarize([window_wav], cache=False)[window_wav]
+                except FileNotFoundError:
+                    # No RTTM: VAD found no speech in this window
+                    turns = []
+                embs, stamps = self.base_embeddings(window_wav)
+                labels = linker.link(turns, embs, stamps)
+
+                offset = start / SAMPLE_RATE
+                for t in turns:
+                    out.write({
+                        "speaker": labels[t["speaker"]],
+                        "start": round(t["start"] + offset, 3),
+                        "end": round(t["end"] + offset, 3)
+                    })
+            print(f"[INFO] Window at {start / SAMPLE_RATE:.0f}s: {len(turns)} turns, "
+                  f"{len(linker.centroids)} speakers so far")
+
+        # No windows at all for empty audio
+        if os.path.exists(window_wav):
+            os.remove(window_wav)
+        metrics.note("speakers", len(linker.centroids))
+        return len(linker.centroids)
+
+    def base_embeddings(self, wav):
+        # Finest-scale embeddings and their [start, end] from the last diarize()
+        scales = self.model.multiscale_embeddings_and_timestamps
+        embeddings, time_stamps = scales[max(scales)]
+        uid = uniq_id(wav)
+        if uid not in embeddings:
+            return np.zeros((0, 0), np.float32), np.zeros((0, 2))
+        return embeddings[uid].cpu().numpy(), np.asarray(time_stamps[uid], dtype=float)
+
+    def _diarize(self, wavs, cache=True):
+        write_manifest(wavs, self.manifest_path, self.num_speakers)
+        self.load()
+        self.model.AUDIO_RTTM_MAP = audio_rttm_map(self.manifest_path)
+
+        print(f"[INFO] Running NeMo diarization on {len(wavs)} file(s)...")
+        # VAD, speaker embeddings and clustering; NeMo does not expose them separately
+        with metrics.span("diarize", audio_seconds(wavs)):
+            self.model.diarize()
+
+        if cache and self.cache_dir:
+            save_cached(self.model, wavs, self.cfg, self.cache_dir)
+
+        rttm_dir = os.path.join(self.out_dir, "pred_rttms")
+        with metrics.span("rttm_parse"):
+            return {w: parse_rttm(os.path.join(rttm_dir, f"{uniq_id(w)}.rttm")) for w in wavs}
+
+# -------------------------
+# Windowed mode
+# -------------------------
+def window_bounds(n, step):
+    # A tail shorter than half a window is folded into the previous window,
+    # which leaves enough audio for the embedding windows and clustering
+    bounds = [[start, min(start + step, n)] for start in range(0, n, step)]
+    if len(bounds) > 1 and bounds[-1][1] - bounds[-1][0] < step // 2:
+        tail = bounds.pop()
+        bounds[-1][1] = tail[1]
+    return bounds
+
+class SpeakerLinker:
+    """Maps per-window speaker labels onto run-wide ones.
+
+    Each run-wide speaker keeps the sum of its embeddings; a window speaker
+    is matched to the most similar unclaimed centroid, or starts a new
+    speaker if none reaches LINK_THRESHOLD.
+    """
+
+    def __init__(self, threshold=LINK_THRESHOLD):
+        self.threshold = threshold
+        self.centroids = []  # embedding sums
+
+    def link(self, turns, embs, stamps):
+        mids = stamps.mean(1) if len(stamps) else stamps
+        local = {}
+        for t in turns:
+            mask = (mids >= t["start"]) & (mids < t["end"])
+            if mask.any():
+                total = local.setdefault(t["speaker"], np.zeros(embs.shape[1]))
+                total += embs[mask].sum(0)
+
+        labels, taken = {}, set()
+        # Most-heard window speakers claim their match first
+        for label, total in sorted(local.items(), key=lambda kv: -np.linalg.norm(kv[1])):
+            best, best_sim = None, self.threshold
+            for k, centroid in enumerate(self.centroids):
+                if k in taken:
+                    continue
+                sim = cosine(total, centroid)
+                if sim >= best_sim:
+                    best, best_sim = k, sim
+            if best is None:
+                best = len(self.centroids)
+                self.centroids.append(np.zeros_like(total))
+            self.centroids[best] += total
+            taken.add(best)
+            labels[label] = f"speaker_{best}"
+
+        # Turns without a single embedding (very short) cannot be linked
+        for t in turns:
+            labels.setdefault(t["speaker"], "UNKNOWN")
+        return labels
+
+def cosine(a, b):
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-9))
+
+# -------------------------
+# PYTHON API
+# -------------------------
+def diarize(audio_paths, **kwargs):
+    """{path: SpeakerSegments}; kwargs go to Diarizer (profile, num_speakers, ...)."""
+    return Diarizer(**kwargs).run(audio_paths)
+
+def recluster(audio_paths, num_speakers=None, cache_dir=DIARIZE_CACHE_DIR, profile=PROFILE, **clustering):
+    """Re-runs clustering only, e.g. recluster(paths, max_num_speakers=3)."""
+    diarizer = Diarizer(clustering=clustering, num_speakers=num_speakers,
+                        cache_dir=cache_dir, profile=profile)
+    return diarizer.run(audio_paths, recluster_only=True)
+
+# -------------------------
+# MAIN
+# -------------------------
+def output_path(audio_path, single):
+    if single:
+        return OUTPUT_JSON
+    return os.path.splitext(audio_path)[0] + ".speakers.json"
+
+def main():
+    parser = argparse.ArgumentParser(description="NeMo speaker diarization")
+    parser.add_argument("paths", nargs="+", metavar="audio_path")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=PROFILE,
+                        help="VAD/embedding speed-accuracy trade-off (default %(default)s)")
+    parser.add_argument("--max-speakers", type=int, help="upper bound on speakers per file")
+    parser.add_argument("--num-speakers", type=int, help="exact number of speakers per file")
+    parser.add_argument("--recluster", action="store_true",
+                        help="only re-cluster cached embeddings, never load the models")
+    parser.add_argument("--window", type=float, default=DIARIZE_WINDOW_SECONDS,
+                        help="diarize in windows of this many seconds (0 = whole file)")
+    args = parser.parse_args()
+    paths = args.paths
+    if args.window and args.recluster:
+        parser.error("--recluster works on whole-file embeddings, not with --window")
+
+    metrics.start("vadspeaker")
+    clustering = {"max_num_speakers": args.max_speakers} if args.max_speakers else None
+    diarizer = Diarizer(clustering=clustering, num_speakers=args.num_speakers, profile=args.profile)
+    metrics.note("profile", args.profile)
+
+    if args.window:
+        turns = 0
+        for path in paths:
+            with TurnWriter(output_path(path, len(paths) == 1), JOIN_GAP) as out:
+                diarizer.run_windowed(path, out, args.window)
+            print(f"✅ {out.path} created ({out.count} turns)")
+            turns += out.count
+        metrics.note("turns", turns)
+        metrics.finish(METRICS_JSON)
+        return
+
+    results = diarizer.run(paths, recluster_only=args.recluster)
 
-with open(rttm) as f:
-    for line in f:
-        p = line.strip().split()
-        segments.append({
-            "speaker": p[7],
-            "start": float(p[3]),
-            "end": float(p[3]) + float(p[4])
-        })
+    with metrics.span("write"):
+        for path, segments in results.items():
+            out = output_path(path, len(paths) == 1)
+            speakerstore.write(segments, out)
+            print(f"✅ {out} created ({len(segments)} turns)")
 
-with open(output_json, "w") as f:
-    json.dump(segments, f, indent=2)
+    metrics.note("turns", sum(len(s) for s in results.values()))
+    metrics.finish(METRICS_JSON)
 
-print("✅ speakers.json created")
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,28 @@
 import os
 import sys
 import json
-import math
-import tempfile
+import time
+import hashlib
+import bisect
+import itertools
+import numpy as np
+import torch
 import whisper
 import yagmail
 import subprocess
+import textwrap
+import threading
+import queue
+import collections
+from array import array
 from typing import List
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import audiocache
+import metrics
+import speakerstore
+from audiocache import file_sha256
+from speakerstore import SpeakerSegments, as_segments
 
 # =========================
 # CONFIG
@@ -18,16 +34,68 @@ FP16 = False
 
 # Chunking
 CHUNK_SECONDS = 30
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE  # 16 kHz mono float32
+
+# Where chunk boundaries come from:
+#   "speakers" = speech turns in speakers.json
+#   "energy"   = frame-energy silence detection
+#   "none"     = fixed CHUNK_SECONDS grid, nothing skipped
+SPEECH_SOURCE = os.environ.get("WHISPER_SPEECH_SOURCE", "energy")
+FRAME_SECONDS = 0.03
+SILENCE_DB = -35.0          # frames this far below the loud (p95) level are silence
+MIN_SILENCE_SECONDS = 1.0   # shorter pauses stay inside a speech span
+SPEECH_PAD_SECONDS = 0.2    # context kept around each speech span
+MAX_BRIDGE_SECONDS = 3.0    # pauses up to this long are packed into one chunk
 
 # Language forcing (None = auto)
 FORCED_LANGUAGE = "en"
 
+# Parallel transcription (1 = serial, in-process model)
+WORKERS = int(os.environ.get("WHISPER_WORKERS", "1"))
+# Torch intra-op threads per worker (0 = split cores evenly across workers)
+TORCH_THREADS = int(os.environ.get("WHISPER_TORCH_THREADS", "0"))
+
+# Chunks whose encoder pass is run together (1 = no batching, serial path only)
+ENCODER_BATCH = int(os.environ.get("WHISPER_ENCODER_BATCH", "1"))
+
+# Draft-then-refine cascade ("" = off). The draft model transcribes
+# everything; only segments it is unsure about are re-run on MODEL_SIZE.
+DRAFT_MODEL = os.environ.get("WHISPER_DRAFT_MODEL", "")
+REFINE_LOGPROB = float(os.environ.get("WHISPER_REFINE_LOGPROB", "-0.7"))
+REFINE_COMPRESSION = float(os.environ.get("WHISPER_REFINE_COMPRESSION", "2.2"))
+
+# Dynamic int8 quantization of the Linear layers (CPU only). The quantized
+# model is saved under QUANT_DIR so later runs skip the fp32 load.
+QUANTIZE = os.environ.get("WHISPER_QUANTIZE", "0") == "1"
+QUANT_DIR = os.environ.get("WHISPER_QUANT_DIR", os.path.expanduser("~/.cache/whisper"))
+
+# Overlap decode -> transcribe -> speaker/output stages through bounded queues.
+# Audio is decoded in PIPELINE_BLOCK_SECONDS blocks and chunks are planned
+# per block, so transcription starts before the whole file is decoded.
+PIPELINE = os.environ.get("WHISPER_PIPELINE", "1") == "1"
+PIPELINE_BLOCK_SECONDS = 300
+PIPELINE_DEPTH = int(os.environ.get("WHISPER_PIPELINE_DEPTH", "4"))
+
+# Long-audio mode: chunks are views into the memory-mapped PCM of the audio
+# cache (needs AUDIO_CACHE_DIR), converted to float one at a time, and the
+# whole file is planned in one pass. Peak memory does not grow with length.
+LONG_AUDIO = os.environ.get("WHISPER_LONG_AUDIO", "0") == "1"
+
+# Per-chunk transcript cache ("" = off), LRU-evicted down to CACHE_MAX_MB
+CACHE_DIR = os.environ.get("WHISPER_CACHE_DIR", ".whisper_cache")
+CACHE_MAX_MB = int(os.environ.get("WHISPER_CACHE_MAX_MB", "512"))
+CACHE_FIELDS = ("start", "end", "text", "avg_logprob", "compression_ratio", "no_speech_prob")
+
 # =========================
 # UTILS
 # =========================
 def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
+def of_total(items):
+    # "/N" for progress lines when the total is known (lists, not streams)
+    return f"/{len(items)}" if hasattr(items, "__len__") else ""
+
 def run(cmd):
     return subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode()
 
@@ -39,102 +107,1066 @@ def get_audio_duration(path):
         path
     ]).strip())
 
+# =========================
+# MODELS
+# =========================
+def quantize_model(model):
+    # whisper.model.Linear only adds a dtype cast in forward(); quantize_dynamic
+    # matches exact types, so hand it plain nn.Linear modules
+    for m in model.modules():
+        if isinstance(m, whisper.model.Linear):
+            m.__class__ = torch.nn.Linear
+
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+def quant_path(name):
+    # Quantized layouts change between releases: one file per version pair
+    return os.path.join(QUANT_DIR, f"{name}-int8-torch{torch.__version__}-whisper{whisper.__version__}.pt")
+
+def build_quantized_model(checkpoint):
+    # Same module tree as quantize_model(load_model(...)), minus the fp32 load
+    model = whisper.model.Whisper(whisper.model.ModelDimensions(**checkpoint["dims"]))
+    model = quantize_model(model)
+    model.load_state_dict(checkpoint["model_state_dict"])
+    if checkpoint["alignment_heads"] is not None:
+        model.set_alignment_heads(checkpoint["alignment_heads"])
+    return model.to(DEVICE)
+
+def load_quantized_model(name):
+    path = quant_path(name)
+
+    if os.path.exists(path):
+        print(f"[INFO] Loading int8 model from {path}")
+        try:
+            return build_quantized_model(torch.load(path, map_location=DEVICE, weights_only=True))
+        except Exception as e:
+            print(f"[WARN] Could not load {path} ({e}), quantizing again")
+
+    model = quantize_model(whisper.load_model(name, device=DEVICE))
+    ensure_dir(QUANT_DIR)
+    torch.save({
+        "dims": vars(model.dims),
+        "alignment_heads": whisper._ALIGNMENT_HEADS.get(name),
+        "model_state_dict": model.state_dict()
+    }, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    print(f"[INFO] Saved int8 model to {path}")
+    return model
+
+def load_whisper(name, quantize=None):
+    quantize = QUANTIZE if quantize is None else quantize
+    with metrics.span("model_load"):
+        if quantize and DEVICE == "cpu":
+            return load_quantized_model(name)
+        return whisper.load_model(name, device=DEVICE)
+
 # =========================
 # AGENT 1: AUDIO CHUNKER
 # =========================
-def chunk_audio(path, chunk_seconds):
-    duration = get_audio_duration(path)
-    print(f"[DEBUG] Audio duration: {duration:.2f}s")
+def load_audio(path):
+    # One decode of the whole file into a 16 kHz mono float32 buffer,
+    # read from the shared normalized-audio cache when it is enabled
+    with metrics.span("decode"):
+        if audiocache.AUDIO_CACHE_DIR:
+            pcm = audiocache.read_pcm(normalized_audio(path))
+            audio = audiocache.pcm_to_float(pcm)
+        else:
+            audio = whisper.load_audio(path, sr=SAMPLE_RATE)
+    print(f"[DEBUG] Audio duration: {len(audio) / SAMPLE_RATE:.2f}s")
+    metrics.note("audio_seconds", len(audio) / SAMPLE_RATE)
+    return audio
 
-    chunks = []
-    total = math.ceil(duration / chunk_seconds)
-
-    for i in range(total):
-        start = i * chunk_seconds
-        out = tempfile.mktemp(suffix=".wav")
-
-        cmd = [
-            "ffmpeg", "-y",
-            "-i", path,
-            "-ss", str(start),
-            "-t", str(chunk_seconds),
-            "-ac", "1",
-            "-ar", "16000",
-            out
+def normalized_audio(path):
+    # ffmpeg runs only on an audio-cache miss
+    with metrics.span("ffmpeg"):
+        return audiocache.normalized_audio(path)
+
+def as_float(chunk):
+    # Long-audio chunks are int16 views into the PCM mapping: convert this
+    # one chunk and let its pages go again
+    if chunk.dtype != np.int16:
+        return chunk
+    audio = audiocache.pcm_to_float(chunk)
+    audiocache.release(chunk)
+    return audio
+
+def frame_energy_db(audio):
+    hop = int(FRAME_SECONDS * SAMPLE_RATE)
+    n = len(audio) // hop
+    frames = audio[:n * hop].reshape(n, hop)
+    # einsum avoids materialising audio**2 for the whole file
+    power = np.einsum("ij,ij->i", frames, frames) / hop
+    return 10 * np.log10(power + 1e-12)
+
+def reference_db(db):
+    # Speech level the silence threshold is relative to
+    return float(np.percentile(db, 95)) if len(db) else None
+
+def energy_speech_spans(db, ref_db=None):
+    # ref_db comes from the whole file when planning part of it: a quiet
+    # block's own p95 is its noise floor, which would all count as speech
+    if len(db) == 0:
+        return []
+    if ref_db is None:
+        ref_db = reference_db(db)
+    voiced = db > ref_db + SILENCE_DB
+    edges = np.diff(voiced.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return [(s * FRAME_SECONDS, e * FRAME_SECONDS) for s, e in zip(starts, ends)]
+
+def speaker_speech_spans(speakers):
+    return sorted(as_segments(speakers).spans())
+
+def merge_spans(spans, duration):
+    merged = []
+    for start, end in spans:
+        start = max(0.0, start - SPEECH_PAD_SECONDS)
+        end = min(duration, end + SPEECH_PAD_SECONDS)
+        if merged and start - merged[-1][1] < MIN_SILENCE_SECONDS:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(m) for m in merged]
+
+def split_long_span(db, start, end, chunk_seconds):
+    # Cut at the quietest frame in the second half of each window
+    pieces = []
+    while end - start > chunk_seconds:
+        lo = int((start + chunk_seconds / 2) / FRAME_SECONDS)
+        hi = int((start + chunk_seconds) / FRAME_SECONDS)
+        window = db[lo:hi]
+        cut = (lo + int(np.argmin(window))) * FRAME_SECONDS if len(window) else start + chunk_seconds
+        pieces.append((start, cut))
+        start = cut
+    pieces.append((start, end))
+    return pieces
+
+def pack_spans(spans, chunk_seconds):
+    packed = []
+    for start, end in spans:
+        if packed and start - packed[-1][1] <= MAX_BRIDGE_SECONDS \
+                and end - packed[-1][0] <= chunk_seconds:
+            packed[-1] = (packed[-1][0], end)
+        else:
+            packed.append((start, end))
+    return packed
+
+def plan_chunks(audio, chunk_seconds, speakers=None, ref_db=None):
+    db = frame_energy_db(audio) if SPEECH_SOURCE != "none" else None
+    return plan_from_db(db, len(audio) / SAMPLE_RATE, chunk_seconds, speakers, ref_db)
+
+def plan_from_db(db, duration, chunk_seconds, speakers=None, ref_db=None):
+    if SPEECH_SOURCE == "none":
+        return [
+            (t, min(t + chunk_seconds, duration))
+            for t in np.arange(0, duration, chunk_seconds).tolist()
         ]
 
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if SPEECH_SOURCE == "speakers" and speakers:
+        spans = speaker_speech_spans(speakers)
+    else:
+        spans = energy_speech_spans(db, ref_db)
+
+    pieces = []
+    for start, end in merge_spans(spans, duration):
+        pieces.extend(split_long_span(db, start, end, chunk_seconds))
+
+    return pack_spans(pieces, chunk_seconds)
+
+def decode_blocks(path, block_seconds):
+    if audiocache.AUDIO_CACHE_DIR:
+        pcm = audiocache.read_pcm(normalized_audio(path))
+        step = int(block_seconds * SAMPLE_RATE)
+        for i in range(0, len(pcm), step):
+            yield audiocache.pcm_to_float(pcm[i:i + step])
+        return
+
+    # Same ffmpeg conversion as whisper.load_audio, read from the pipe in blocks
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0",
+        "-i", path,
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le",
+        "-ar", str(SAMPLE_RATE),
+        "-"
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    block_bytes = int(block_seconds * SAMPLE_RATE) * 2
+
+    try:
+        while True:
+            data = proc.stdout.read(block_bytes)
+            if not data:
+                break
+            yield np.frombuffer(data, np.int16).astype(np.float32) / 32768.0
+    finally:
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {path}")
+
+def pcm_energy_db(pcm):
+    # Frame energy of int16 PCM, block by block; blocks are whole frames, so
+    # the result matches frame_energy_db over the whole file
+    hop = int(FRAME_SECONDS * SAMPLE_RATE)
+    step = hop * int(PIPELINE_BLOCK_SECONDS / FRAME_SECONDS)
+    if len(pcm) < hop:
+        return np.empty(0)
+    return np.concatenate([
+        frame_energy_db(as_float(pcm[i:i + step]))
+        for i in range(0, len(pcm), step)
+    ])
+
+def shift_speakers(speakers, start, end):
+    # Turns overlapping [start, end), in buffer-relative seconds
+    return as_segments(speakers).window(start, end)
+
+def mmap_chunks(path, chunk_seconds, speakers=None):
+    # Frame energy is computed block by block (blocks are whole frames, so
+    # the plan matches chunk_audio's), then chunks are yielded as views
+    pcm = audiocache.read_pcm(normalized_audio(path))
+    if len(pcm) == 0:
+        raise RuntimeError("Audio decoded to zero samples")
+
+    duration = len(pcm) / SAMPLE_RATE
+    metrics.note("audio_seconds", duration)
+    with metrics.span("plan", duration):
+        db = pcm_energy_db(pcm) if SPEECH_SOURCE != "none" else None
+        plan = plan_from_db(db, duration, chunk_seconds, speakers)
+
+    kept = sum(end - start for start, end in plan)
+    metrics.note("speech_seconds", kept)
+    print(f"[INFO] {len(plan)} chunks, skipped {duration - kept:.1f}s of "
+          f"{duration:.1f}s as non-speech ({SPEECH_SOURCE})")
+
+    for i, (start, end) in enumerate(plan, 1):
+        print(f"[DEBUG] Chunk {i}/{len(plan)} ready ({start:.1f}s-{end:.1f}s)")
+        yield pcm[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)], start
+
+def stream_chunks(path, chunk_seconds, speakers=None):
+    # Plans each decoded block on its own. The last planned chunk may still
+    # grow, so its audio is carried over into the next block.
+    if LONG_AUDIO:
+        yield from mmap_chunks(path, chunk_seconds, speakers)
+        return
+
+    buf = np.empty(0, np.float32)
+    buf_start = 0.0
+    decoded = kept = 0.0
+    count = 0
+
+    # The speech level must be the file's, not each block's. From the cached
+    # PCM one energy pass gives chunk_audio's level up front; from an ffmpeg
+    # pipe the loudest block so far stands in (so only quiet audio before
+    # the first speech can still be planned against its own noise floor).
+    ref_db = None
+    if SPEECH_SOURCE != "none" and audiocache.AUDIO_CACHE_DIR:
+        with metrics.span("plan"):
+            ref_db = reference_db(pcm_energy_db(audiocache.read_pcm(normalized_audio(path))))
+    running = ref_db is None
+
+    blocks = decode_blocks(path, PIPELINE_BLOCK_SECONDS)
+    with metrics.span("decode"):
+        block = next(blocks, None)
+    while block is not None:
+        decoded += len(block) / SAMPLE_RATE
+        buf = np.concatenate([buf, block])
+        with metrics.span("decode"):
+            block = next(blocks, None)
+        last = block is None
+
+        buf_end = buf_start + len(buf) / SAMPLE_RATE
+        local = shift_speakers(speakers, buf_start, buf_end) if speakers else None
+        with metrics.span("plan", len(buf) / SAMPLE_RATE):
+            db = frame_energy_db(buf) if SPEECH_SOURCE != "none" else None
+            if running and db is not None and len(db):
+                ref_db = max(reference_db(db), ref_db if ref_db is not None else -np.inf)
+            plan = plan_from_db(db, len(buf) / SAMPLE_RATE, chunk_seconds, local, ref_db)
+        final = plan if last else plan[:-1]
+
+        for start, end in final:
+            count += 1
+            kept += end - start
+            print(f"[DEBUG] Chunk {count} ready ({buf_start + start:.1f}s-{buf_start + end:.1f}s)")
+            yield buf[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)], buf_start + start
 
-        if not os.path.exists(out) or os.path.getsize(out) < 10_000:
-            raise RuntimeError(f"Chunk {i} failed to generate")
+        if not last:
+            carry = int(plan[-1][0] * SAMPLE_RATE) if plan else len(buf)
+            buf = buf[carry:].copy()
+            buf_start += carry / SAMPLE_RATE
 
-        print(f"[DEBUG] Chunk {i+1}/{total} created ({os.path.getsize(out)/1024:.1f} KB)")
-        chunks.append((out, start))
+    if decoded == 0:
+        raise RuntimeError("Audio decoded to zero samples")
+
+    metrics.note("audio_seconds", decoded)
+    metrics.note("speech_seconds", kept)
+    print(f"[INFO] {count} chunks, skipped {decoded - kept:.1f}s of "
+          f"{decoded:.1f}s as non-speech ({SPEECH_SOURCE})")
+
+def chunk_audio(path, chunk_seconds, speakers=None):
+    if LONG_AUDIO:
+        return list(mmap_chunks(path, chunk_seconds, speakers))
+
+    audio = load_audio(path)
+
+    if len(audio) == 0:
+        raise RuntimeError("Audio decoded to zero samples")
+
+    duration = len(audio) / SAMPLE_RATE
+    with metrics.span("plan", duration):
+        plan = plan_chunks(audio, chunk_seconds, speakers)
+    kept = sum(end - start for start, end in plan)
+    metrics.note("speech_seconds", kept)
+    print(f"[INFO] {len(plan)} chunks, skipped {duration - kept:.1f}s of "
+          f"{duration:.1f}s as non-speech ({SPEECH_SOURCE})")
+
+    # Slices are views into the decoded buffer: no copies, no temp files
+    chunks = []
+    for i, (start, end) in enumerate(plan, 1):
+        chunk = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        print(f"[DEBUG] Chunk {i}/{len(plan)} ready ({start:.1f}s-{end:.1f}s)")
+        chunks.append((chunk, start))
 
     return chunks
 
 # =========================
 # AGENT 2: TRANSCRIPTION
 # =========================
-def transcribe_chunks(model, chunks):
-    segments = []
+def transcribe_chunk(model, chunk, offset):
+    result = model.transcribe(
+        as_float(chunk),
+        fp16=FP16,
+        language=FORCED_LANGUAGE,
+        verbose=False
+    )
+
+    for seg in result["segments"]:
+        seg["start"] += offset
+        seg["end"] += offset
+
+    return result["segments"]
+
+def transcribe_chunks(model, chunks, workers=1):
+    # Generator: segments are yielded as soon as their chunk is done
+    for _, segs in chunk_results(model, chunks, workers):
+        yield from segs
+
+def chunk_results(model, chunks, workers=1, draft=None, stats=None):
+    # (offset, segments) per chunk, in offset order, for every mode
+    if draft is not None:
+        yield from transcribe_chunks_cascade(draft, model, chunks, stats if stats is not None else {})
+        return
+
+    if workers > 1:
+        yield from transcribe_chunks_parallel(chunks, workers)
+        return
+
+    if ENCODER_BATCH > 1:
+        yield from transcribe_chunks_batched(model, chunks, ENCODER_BATCH)
+        return
+
+    for i, (chunk, offset) in enumerate(chunks, 1):
+        print(f"[INFO] Transcribing chunk {i}{of_total(chunks)}")
+        with metrics.span("transcribe", len(chunk) / SAMPLE_RATE):
+            segs = transcribe_chunk(model, chunk, offset)
+        yield offset, segs
+
+class PrecomputedEncoder(torch.nn.Module):
+    """Stands in for model.encoder while a batch is being decoded.
+
+    transcribe() still builds its own mel window and calls the encoder; if
+    that window matches one encoded in the batch, the batched features are
+    returned, otherwise the real encoder runs. Decoding, temperature
+    fallback and segment splitting stay exactly those of transcribe().
+    """
+
+    def __init__(self, encoder):
+        super().__init__()
+        self.encoder = encoder
+        self.features = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(mel):
+        return hashlib.sha1(mel.detach().cpu().numpy().tobytes()).digest()
+
+    def forward(self, mel):
+        if mel.shape[0] == 1:
+            cached = self.features.get(self.key(mel[0]))
+            if cached is not None:
+                self.hits += 1
+                return cached.unsqueeze(0)
+        self.misses += 1
+        return self.encoder(mel)
+
+def first_window_mel(model, chunk):
+    # Same first mel window that transcribe() feeds the encoder
+    n_frames = whisper.audio.N_FRAMES
+    mel = whisper.log_mel_spectrogram(
+        as_float(chunk),
+        n_mels=getattr(model.dims, "n_mels", 80),
+        padding=whisper.audio.N_SAMPLES
+    )
+    content_frames = mel.shape[-1] - n_frames
+    window = mel[:, :min(n_frames, content_frames)]
+    return whisper.pad_or_trim(window, n_frames).to(model.device)
+
+def transcribe_chunks_batched(model, chunks, batch_size):
+    encoder = model.encoder
+    cached = PrecomputedEncoder(encoder)
+    model.encoder = cached
+
+    total = of_total(chunks)
+    chunks = iter(chunks)
+    b = 0
 
-    for i, (chunk_path, offset) in enumerate(chunks, 1):
-        print(f"[INFO] Transcribing chunk {i}/{len(chunks)}")
+    try:
+        while True:
+            batch = list(itertools.islice(chunks, batch_size))
+            if not batch:
+                break
+            with metrics.span("batch_encode"):
+                mels = [first_window_mel(model, chunk) for chunk, _ in batch]
+                with torch.no_grad():
+                    features = encoder(torch.stack(mels))
+                cached.features = {
+                    cached.key(mel): feat for mel, feat in zip(mels, features)
+                }
 
-        result = model.transcribe(
-            chunk_path,
-            fp16=FP16,
-            language=FORCED_LANGUAGE,
-            verbose=False
+            for i, (chunk, offset) in enumerate(batch, b + 1):
+                print(f"[INFO] Transcribing chunk {i}{total} (batch of {len(batch)})")
+                with metrics.span("transcribe", len(chunk) / SAMPLE_RATE):
+                    segs = transcribe_chunk(model, chunk, offset)
+                yield offset, segs
+            b += len(batch)
+    finally:
+        model.encoder = encoder
+        print(f"[INFO] Batched encoder: {cached.hits} reused, {cached.misses} re-encoded")
+
+# Each pool worker loads its own model once, in its initializer
+_worker_model = None
+
+def _init_worker(model_size, threads):
+    global _worker_model
+    torch.set_num_threads(threads)
+    _worker_model = load_whisper(model_size)
+
+def _transcribe_in_worker(chunk, offset):
+    return offset, transcribe_chunk(_worker_model, chunk, offset)
+
+def worker_threads(workers):
+    if TORCH_THREADS > 0:
+        return TORCH_THREADS
+    return max(1, (os.cpu_count() or 1) // workers)
+
+def transcribe_chunks_parallel(chunks, workers, model_size=None):
+    model_size = model_size or MODEL_SIZE
+    threads = worker_threads(workers)
+    print(f"[INFO] Transcribing with {workers} workers x {threads} torch threads")
+
+    # spawn: never fork a parent that has already initialised torch
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(model_size, threads)
+    ) as pool:
+        # Waiting in submission order keeps output in offset order while
+        # later chunks keep running. At most 2 chunks per worker are in
+        # flight, so a streamed input is not read far ahead.
+        # Worker time is not visible here: "transcribe" is the time spent
+        # waiting on results, which is what the job pays.
+        total = of_total(chunks)
+        pending = collections.deque()
+        done = 0
+        for chunk, offset in itertools.chain(chunks, [(None, None)]):
+            if chunk is not None:
+                fut = pool.submit(_transcribe_in_worker, chunk, offset)
+                pending.append((fut, len(chunk) / SAMPLE_RATE))
+                if len(pending) < 2 * workers:
+                    continue
+            while pending and (chunk is None or len(pending) >= 2 * workers):
+                fut, seconds = pending.popleft()
+                with metrics.span("transcribe", seconds):
+                    offset, segs = fut.result()
+                done += 1
+                print(f"[INFO] Transcribed chunk {done}{total} (offset {offset:.1f}s)")
+                yield offset, segs
+
+def needs_refine(seg):
+    return (
+        seg["avg_logprob"] < REFINE_LOGPROB
+        or seg["compression_ratio"] > REFINE_COMPRESSION
+    )
+
+def refine_spans(segments):
+    # Runs of consecutive low-confidence segments; a confident one breaks the run
+    spans = []
+    run = None
+    for seg in segments:
+        if needs_refine(seg):
+            if run is None:
+                run = [seg["start"], seg["end"]]
+                spans.append(run)
+            else:
+                run[1] = seg["end"]
+        else:
+            run = None
+    return spans
+
+def report_escalation(stats):
+    # stats as filled by transcribe_chunks_cascade; empty without a draft model
+    if stats.get("audio_seconds"):
+        metrics.note("escalated_seconds", stats["escalated_seconds"])
+        print(
+            f"[INFO] Escalated {stats['escalated_seconds']:.1f}s of "
+            f"{stats['audio_seconds']:.1f}s to {MODEL_SIZE} "
+            f"({stats['escalated_seconds'] / stats['audio_seconds']:.1%})"
         )
 
-        for seg in result["segments"]:
-            seg["start"] += offset
-            seg["end"] += offset
-            segments.append(seg)
+def transcribe_chunks_cascade(draft, model, chunks, stats):
+    stats.setdefault("audio_seconds", 0.0)
+    stats.setdefault("escalated_seconds", 0.0)
+
+    for i, (chunk, offset) in enumerate(chunks, 1):
+        print(f"[INFO] Drafting chunk {i}{of_total(chunks)}")
+        with metrics.span("draft", len(chunk) / SAMPLE_RATE):
+            drafted = transcribe_chunk(draft, chunk, offset)
+        stats["audio_seconds"] += len(chunk) / SAMPLE_RATE
 
-        os.remove(chunk_path)
+        spans = refine_spans(drafted)
+        if not spans:
+            yield offset, drafted
+            continue
 
-    return segments
+        refined = [seg for seg in drafted if not needs_refine(seg)]
+        for start, end in spans:
+            a = max(0, int((start - offset) * SAMPLE_RATE))
+            b = min(len(chunk), int((end - offset) * SAMPLE_RATE))
+            if b <= a:
+                continue
+            print(f"[INFO] Refining {start:.1f}s-{end:.1f}s with {MODEL_SIZE}")
+            with metrics.span("refine", (b - a) / SAMPLE_RATE):
+                refined.extend(transcribe_chunk(model, chunk[a:b], offset + a / SAMPLE_RATE))
+            stats["escalated_seconds"] += (b - a) / SAMPLE_RATE
+
+        refined.sort(key=lambda seg: seg["start"])
+        yield offset, refined
+
+# =========================
+# TRANSCRIPT CACHE
+# =========================
+def cache_options(speakers):
+    # Everything that changes the chunk plan or the decoded text
+    options = {
+        "model": MODEL_SIZE,
+        "language": FORCED_LANGUAGE,
+        "fp16": FP16,
+        "int8": QUANTIZE,
+        "chunk_seconds": CHUNK_SECONDS,
+        "speech": [SPEECH_SOURCE, FRAME_SECONDS, SILENCE_DB, MIN_SILENCE_SECONDS,
+                   SPEECH_PAD_SECONDS, MAX_BRIDGE_SECONDS],
+        "draft": [DRAFT_MODEL, REFINE_LOGPROB, REFINE_COMPRESSION] if DRAFT_MODEL else None,
+        # Block-wise planning can place boundaries differently, and its speech
+        # level is the whole file's only with the audio cache
+        "pipeline": [PIPELINE_BLOCK_SECONDS, bool(audiocache.AUDIO_CACHE_DIR)]
+                    if PIPELINE and not LONG_AUDIO else None,
+    }
+    if SPEECH_SOURCE == "speakers" and speakers:
+        options["speakers"] = as_segments(speakers).digest()
+    return options
+
+class ChunkCache:
+    """Finished chunks for one (audio content, decode options) pair.
+
+    Stored as JSONL: one line per transcribed chunk, appended as soon as
+    the chunk is done, and a final line with the full chunk plan once every
+    chunk is in. A crash leaves at most one torn last line, which is
+    dropped on the next load.
+
+    Only the byte position of each chunk's line is kept in memory; segments
+    are read back from the file when they are needed.
+    """
+
+    def __init__(self, audio_path, options, cache_dir=CACHE_DIR):
+        opts = hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()
+        self.path = os.path.join(cache_dir, f"{file_sha256(audio_path)[:32]}-{opts[:16]}.jsonl")
+        self.plan = None
+        self.done = {}  # chunk offset -> byte position of its line
+        ensure_dir(cache_dir)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        torn = False
+        pos = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("torn line")
+                    rec = json.loads(line)
+                except ValueError:
+                    torn = True
+                    break
+                if "plan" in rec:
+                    self.plan = [tuple(p) for p in rec["plan"]]
+                else:
+                    self.done[rec["offset"]] = pos
+                pos += len(line)
+
+        if torn:
+            self._rewrite()
+        audiocache.touch(self.path)
+
+    def _rewrite(self):
+        tmp = self.path + ".tmp"
+        done = {}
+        with open(self.path, "rb") as src, open(tmp, "wb") as f:
+            for offset in sorted(self.done):
+                src.seek(self.done[offset])
+                done[offset] = f.tell()
+                f.write(src.readline())
+            if self.plan is not None:
+                f.write((json.dumps({"plan": self.plan}) + "\n").encode())
+        os.replace(tmp, self.path)
+        self.done = done
+
+    def _append(self, rec):
+        with open(self.path, "ab") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            f.write((json.dumps(rec) + "\n").encode())
+        return pos
+
+    def finish(self, plan):
+        self.plan = [tuple(p) for p in plan]
+        self._append({"plan": self.plan})
+
+    def complete(self):
+        return self.plan is not None and all(start in self.done for start, _ in self.plan)
+
+    def add(self, offset, segments):
+        segments = [{k: seg[k] for k in CACHE_FIELDS if k in seg} for seg in segments]
+        self.done[offset] = self._append({"offset": offset, "segments": segments})
+
+    def _read(self, f, offset):
+        f.seek(self.done[offset])
+        return json.loads(f.readline())["segments"]
+
+    def get(self, offset):
+        with open(self.path, "rb") as f:
+            return self._read(f, offset)
+
+    def results(self):
+        with open(self.path, "rb") as f:
+            for start, _ in self.plan:
+                yield start, self._read(f, start)
+
+def cached_chunk_results(cache, chunks, transcribe):
+    # Only chunks missing from the cache are transcribed. chunks may be a
+    # stream, so cached chunks are released in plan order as soon as every
+    # chunk before them is available.
+    plan = []
+    order = collections.deque()
+    hits = 0
+
+    def todo():
+        nonlocal hits
+        for chunk, offset in chunks:
+            plan.append((offset, offset + len(chunk) / SAMPLE_RATE))
+            order.append(offset)
+            if offset in cache.done:
+                hits += 1
+            else:
+                yield chunk, offset
+
+    for offset, segs in transcribe(todo()):
+        cache.add(offset, segs)
+        while order and order[0] in cache.done:
+            ready = order.popleft()
+            yield ready, cache.get(ready)
+
+    while order:
+        ready = order.popleft()
+        yield ready, cache.get(ready)
+
+    cache.finish(plan)
+    print(f"[INFO] Cache: {hits}/{len(plan)} chunks reused")
+
+def evict_cache(cache_dir=CACHE_DIR, max_mb=CACHE_MAX_MB):
+    audiocache.evict_lru(cache_dir, ".jsonl", max_mb)
 
 # =========================
 # AGENT 3: DIARIZATION (simple, CPU-safe)
 # =========================
 def load_speakers(path="speakers.json"):
-    with open(path) as f:
-        return json.load(f)
+    # speakers.npz when it is current, else speakers.json (and the NPZ is written)
+    return speakerstore.load(path)
+
+class SpeakerIndex:
+    """Speaker turns sorted by start, for largest-overlap lookups.
+
+    ``max_end[i]`` is the running maximum of turn ends up to ``i``, so the
+    turns that can overlap [start, end) are exactly those in
+    ``[bisect_right(max_end, start), bisect_left(starts, end))``. That holds
+    even when diarization emits overlapping turns.
+    """
+
+    def __init__(self, speakers):
+        # SpeakerSegments are already sorted by start; lists are for the
+        # per-element access in best_in, which NumPy scalars would slow down
+        turns = as_segments(speakers)
+        self.starts = turns.starts.tolist()
+        self.ends = turns.ends.tolist()
+        self.labels = turns.speakers()
+        self.max_end = np.maximum.accumulate(turns.ends).tolist()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def best_in(self, lo, hi, start, end):
+        best, best_overlap = "UNKNOWN", 0.0
+        for j in range(lo, hi):
+            overlap = min(end, self.ends[j]) - max(start, self.starts[j])
+            if overlap > best_overlap:
+                best, best_overlap = self.labels[j], overlap
+        return best
+
+    def find(self, start, end):
+        lo = bisect.bisect_right(self.max_end, start)
+        hi = bisect.bisect_left(self.starts, end)
+        return self.best_in(lo, hi, start, end)
+
+def find_speaker(start, end, index):
+    return index.find(start, end)
+
+def assign_speakers(segments, index):
+    """Sweep-line assignment for a whole batch of segments.
+
+    Segments are visited in start order while the lower pointer only moves
+    forward over the turns, so the whole pass is O(n log n).
+    """
+    return assign_spans(
+        [s["start"] for s in segments],
+        [s["end"] for s in segments],
+        index
+    )
+
+def assign_spans(starts, ends, index):
+    order = sorted(range(len(starts)), key=starts.__getitem__)
+    speakers = ["UNKNOWN"] * len(starts)
 
-def find_speaker(start, end, speakers):
-    for s in speakers:
-        if start >= s["start"] and end <= s["end"]:
-            return s["speaker"]
-    return "UNKNOWN"
+    lo = 0
+    n = len(index)
+    for i in order:
+        start, end = starts[i], ends[i]
+        # max_end is non-decreasing and starts arrive in order: lo never goes back
+        while lo < n and index.max_end[lo] <= start:
+            lo += 1
+        stop = bisect.bisect_left(index.starts, end, lo)
+        speakers[i] = index.best_in(lo, stop, start, end)
 
+    return speakers
+
+# =========================
+# SEGMENT STORE
+# =========================
+class SegmentStore:
+    """Compact transcript: start/end/speaker/text and nothing else.
+
+    Times are float64 arrays, speakers are indexes into a label table and
+    all text lives in one UTF-8 buffer with an end-offset array, so a
+    segment costs ~18 bytes plus its text instead of a Whisper dict with
+    its token list. Iterating yields the same rows diarize() builds, one
+    at a time, for the writers.
+    """
+
+    def __init__(self):
+        self.starts = array("d")
+        self.ends = array("d")
+        self.speaker_ids = array("H")
+        self.labels = ["UNKNOWN"]
+        self._label_ids = {"UNKNOWN": 0}
+        self._text = bytearray()
+        self._text_ends = array("Q")
+
+    def __len__(self):
+        return len(self.starts)
+
+    def label_id(self, speaker):
+        if speaker not in self._label_ids:
+            self._label_ids[speaker] = len(self.labels)
+            self.labels.append(speaker)
+        return self._label_ids[speaker]
+
+    def append(self, start, end, text, speaker="UNKNOWN"):
+        self.starts.append(start)
+        self.ends.append(end)
+        self.speaker_ids.append(self.label_id(speaker))
+        self._text += text.encode("utf-8")
+        self._text_ends.append(len(self._text))
+
+    def extend(self, segments):
+        # Whisper segments: everything but the times and the text is dropped
+        for seg in segments:
+            self.append(seg["start"], seg["end"], seg["text"].strip())
+
+    def text(self, i):
+        lo = self._text_ends[i - 1] if i else 0
+        return self._text[lo:self._text_ends[i]].decode("utf-8")
+
+    def assign(self, index):
+        self.speaker_ids = array("H", (
+            self.label_id(speaker) for speaker in assign_spans(self.starts, self.ends, index)
+        ))
+
+    def __getitem__(self, i):
+        return {
+            "speaker": self.labels[self.speaker_ids[i]],
+            "start": self.starts[i],
+            "end": self.ends[i],
+            "text": self.text(i)
+        }
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def nbytes(self):
+        arrays = (self.starts, self.ends, self.speaker_ids, self._text_ends)
+        return sum(a.itemsize * len(a) for a in arrays) + len(self._text)
 
 # =========================
 # AGENT 4: SUBTITLES
 # =========================
-def write_srt(segments, path):
-    def ts(t):
-        h = int(t // 3600)
-        m = int((t % 3600) // 60)
-        s = int(t % 60)
-        ms = int((t - int(t)) * 1000)
-        return f"{h:02}:{m:02}:{s:02},{ms:03}"
+def srt_ts(t):
+    h = int(t // 3600)
+    m = int((t % 3600) // 60)
+    s = int(t % 60)
+    ms = int((t - int(t)) * 1000)
+    return f"{h:02}:{m:02}:{s:02},{ms:03}"
+
+def format_txt(s):
+    return f"[{s['speaker']}] {s['text']}\n"
+
+def format_srt(i, s):
+    return (
+        f"{i}\n"
+        f"{srt_ts(s['start'])} --> {srt_ts(s['end'])}\n"
+        f"[{s['speaker']}] {s['text']}\n\n"
+    )
 
+def format_vtt(s):
+    return (
+        f"{s['start']:.3f} --> {s['end']:.3f}\n"
+        f"[{s['speaker']}] {s['text']}\n\n"
+    )
+
+def write_srt(segments, path):
     with open(path, "w", encoding="utf-8") as f:
         for i, s in enumerate(segments, 1):
-            f.write(f"{i}\n")
-            f.write(f"{ts(s['start'])} --> {ts(s['end'])}\n")
-            f.write(f"[{s['speaker']}] {s['text']}\n\n")
+            f.write(format_srt(i, s))
 
 def write_vtt(segments, path):
     with open(path, "w", encoding="utf-8") as f:
         f.write("WEBVTT\n\n")
         for s in segments:
-            f.write(f"{s['start']:.3f} --> {s['end']:.3f}\n")
-            f.write(f"[{s['speaker']}] {s['text']}\n\n")
+            f.write(format_vtt(s))
+
+class TranscriptWriter:
+    """Appends each segment to txt/srt/vtt/result.json as it arrives.
+
+    Every write is flushed, so the files are a usable partial transcript
+    while the job is still running. result.json becomes valid JSON once
+    the writer is closed.
+    """
+
+    def __init__(self, out_dir, base="transcript", result_path="result.json"):
+        self.txt = f"{out_dir}/{base}.txt"
+        self.srt = f"{out_dir}/{base}.srt"
+        self.vtt = f"{out_dir}/{base}.vtt"
+        self.result_path = result_path
+        self.count = 0
+
+        self._txt = open(self.txt, "w", encoding="utf-8")
+        self._srt = open(self.srt, "w", encoding="utf-8")
+        self._vtt = open(self.vtt, "w", encoding="utf-8")
+        self._json = open(result_path, "w", encoding="utf-8")
+
+        self._vtt.write("WEBVTT\n\n")
+        self._json.write("[")
+
+    def write(self, s):
+        self.count += 1
+        self._txt.write(format_txt(s))
+        self._srt.write(format_srt(self.count, s))
+        self._vtt.write(format_vtt(s))
+        sep = "," if self.count > 1 else ""
+        self._json.write(sep + "\n" + textwrap.indent(json.dumps(s, indent=2), "  "))
+
+        for f in self.files():
+            f.flush()
+
+    def files(self):
+        return (self._txt, self._srt, self._vtt, self._json)
+
+    def close(self):
+        self._json.write("\n]" if self.count else "]")
+        for f in self.files():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def diarize(seg, index):
+    return {
+        "speaker": find_speaker(seg["start"], seg["end"], index),
+        "start": seg["start"],
+        "end": seg["end"],
+        "text": seg["text"].strip()
+    }
+
+def write_results(results, index, out):
+    for _, segs in results:
+        with metrics.span("write"):
+            for seg in segs:
+                out.write(diarize(seg, index))
+
+def write_store(store, out):
+    # Speakers must already be assigned (SegmentStore.assign)
+    with metrics.span("write"):
+        for row in store:
+            out.write(row)
+
+# =========================
+# PIPELINE
+# =========================
+_DONE = object()
+
+class _Failed:
+    def __init__(self, exc):
+        self.exc = exc
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0   # seconds spent producing items
+        self.wait = 0.0   # part of busy spent blocked on the input queue
+        self.items = 0
+        self.depth_sum = 0
+        self.depth_max = 0
+
+    def sample(self, q):
+        depth = q.qsize()
+        self.depth_sum += depth
+        self.depth_max = max(self.depth_max, depth)
+
+    def report(self):
+        line = f"[STATS] {self.name:<10} busy {max(0.0, self.busy - self.wait):8.2f}s  items {self.items:6d}"
+        if self.items and self.depth_max:
+            line += f"  out-queue avg {self.depth_sum / self.items:.1f} max {self.depth_max}"
+        print(line)
+
+def produce(items, q, stats, stop=None):
+    # Pulls items (timed as stage work) into a bounded queue; always ends
+    # the queue with _DONE, preceded by _Failed if the stage raised
+    try:
+        it = iter(items)
+        while stop is None or not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                break
+            stats.busy += time.perf_counter() - t0
+            stats.items += 1
+            stats.sample(q)
+            q.put(item)
+    except BaseException as e:
+        q.put(_Failed(e))
+        return e
+    finally:
+        q.put(_DONE)
+
+def drain(q, stats=None):
+    while True:
+        t0 = time.perf_counter()
+        item = q.get()
+        if stats is not None:
+            stats.wait += time.perf_counter() - t0
+        if item is _DONE:
+            return
+        if isinstance(item, _Failed):
+            raise item.exc
+        yield item
+
+def consume_writes(q, stats, index, out, errors, stop):
+    try:
+        for _, segs in drain(q):
+            t0 = time.perf_counter()
+            with metrics.span("write"):
+                for seg in segs:
+                    out.write(diarize(seg, index))
+            stats.busy += time.perf_counter() - t0
+            stats.items += 1
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+        # Keep draining so the transcribe stage never blocks on a full queue
+        while q.get() is not _DONE:
+            pass
+
+def run_pipeline(audio_path, speakers, results_for, index, out):
+    decode = StageStats("decode")
+    transcribe = StageStats("transcribe")
+    write = StageStats("write")
+    chunk_q = queue.Queue(maxsize=PIPELINE_DEPTH)
+    seg_q = queue.Queue(maxsize=PIPELINE_DEPTH)
+    errors = []
+    stop = threading.Event()
+
+    decoder = threading.Thread(
+        target=produce,
+        args=(stream_chunks(audio_path, CHUNK_SECONDS, speakers), chunk_q, decode, stop),
+        daemon=True
+    )
+    writer = threading.Thread(
+        target=consume_writes,
+        args=(seg_q, write, index, out, errors, stop),
+        daemon=True
+    )
+    decoder.start()
+    writer.start()
+
+    # Transcription stays on the calling thread, next to the model
+    error = produce(results_for(drain(chunk_q, transcribe)), seg_q, transcribe, stop)
+    stop.set()
+    writer.join()
+    # Unblock the decoder if it is still waiting to hand over a chunk
+    while decoder.is_alive():
+        try:
+            chunk_q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+    for stage in (decode, transcribe, write):
+        stage.report()
+    metrics.note("pipeline", {
+        stage.name: {"busy_seconds": round(max(0.0, stage.busy - stage.wait), 3), "items": stage.items}
+        for stage in (decode, transcribe, write)
+    })
+
+    if error is not None:
+        raise error
+    if errors:
+        raise errors[0]
 
 # =========================
 # AGENT 5: DELIVERY
@@ -154,10 +1186,7 @@ def send_email(to, attachments):
 # =========================
 # MAIN
 # =========================
-def main():
-    audio_path = sys.argv[1]
-    emails = sys.argv[2]
-
+def check_audio(audio_path):
     print(f"[DEBUG] Audio path: {audio_path}")
 
     if not os.path.exists(audio_path):
@@ -165,46 +1194,124 @@ def main():
 
     print(f"[DEBUG] Audio size: {os.path.getsize(audio_path)/(1024*1024):.2f} MB")
 
-    ensure_dir(OUTPUT_DIR)
+def load_models(workers=WORKERS):
+    model = None
+    if workers <= 1 or DRAFT_MODEL:
+        print("[INFO] Loading Whisper model...")
+        model = load_whisper(MODEL_SIZE)
+
+    draft = None
+    if DRAFT_MODEL:
+        # The cascade runs in-process with both models, WORKERS is ignored
+        print(f"[INFO] Loading draft model ({DRAFT_MODEL})...")
+        draft = load_whisper(DRAFT_MODEL)
+
+    return model, draft
+
+def job_speakers(speakers_path):
+    if speakerstore.exists(speakers_path):
+        return load_speakers(speakers_path)
+    print(f"[WARN] {speakers_path} not found, speakers will be UNKNOWN")
+    return SpeakerSegments.empty()
+
+def open_cache(audio_path, speakers):
+    if not CACHE_DIR:
+        return None
+    return ChunkCache(audio_path, cache_options(speakers))
 
-    print("[INFO] Loading Whisper model...")
-    model = whisper.load_model(MODEL_SIZE, device=DEVICE)
+def transcript_cached(audio_path, speakers_path="speakers.json"):
+    # True when a rerun needs neither the model nor an audio decode
+    cache = open_cache(audio_path, job_speakers(speakers_path))
+    return cache is not None and cache.complete()
 
-    print("[INFO] Chunking audio...")
-    chunks = chunk_audio(audio_path, CHUNK_SECONDS)
+def run_job(audio_path, model, draft=None, out_dir=OUTPUT_DIR,
+            result_path="result.json", speakers_path="speakers.json",
+            workers=WORKERS):
+    if LONG_AUDIO and not audiocache.AUDIO_CACHE_DIR:
+        raise RuntimeError("WHISPER_LONG_AUDIO=1 needs AUDIO_CACHE_DIR for the PCM mapping")
+    ensure_dir(out_dir)
 
-    print("[INFO] Transcribing...")
-    segments = transcribe_chunks(model, chunks)
+    # main() starts the run before loading models, so model load is in it
+    if metrics.active() is None:
+        metrics.start("whisperagent")
+    metrics.note("audio_path", audio_path)
+    metrics.note("model", MODEL_SIZE)
+    metrics_path = os.path.join(os.path.dirname(result_path), "metrics.json")
+    hooks = []
+    for name, m in (("encoder", model), ("draft_encoder", draft)):
+        # Stand-ins without a torch encoder (whisperbench's StubModel) go untimed
+        if isinstance(getattr(m, "encoder", None), torch.nn.Module):
+            hooks += metrics.time_module(m.encoder, name)
 
+    try:
+        return _run_job(audio_path, model, draft, out_dir, result_path, speakers_path, workers)
+    except BaseException as e:
+        metrics.note("error", repr(e))
+        raise
+    finally:
+        for hook in hooks:
+            hook.remove()
+        stages = metrics.active().stages
+        if "encoder" in stages and "transcribe" in stages:
+            # transcribe() time outside the encoder: mel, decoding, fallback
+            metrics.note("decoder_seconds", round(
+                stages["transcribe"]["seconds"] - stages["encoder"]["seconds"], 3))
+        metrics.finish(metrics_path)
+
+def _run_job(audio_path, model, draft, out_dir, result_path, speakers_path, workers):
     print("[INFO] Loading speaker segments...")
-    speakers = load_speakers()
+    with metrics.span("speakers"):
+        speakers = job_speakers(speakers_path)
+        index = SpeakerIndex(speakers)
 
-    diarized = []
-    for seg in segments:
-        diarized.append({
-            "speaker": find_speaker(seg["start"], seg["end"], speakers),
-            "start": seg["start"],
-            "end": seg["end"],
-            "text": seg["text"].strip()
-        })
+    stats = {}
+    cache = open_cache(audio_path, speakers)
+
+    def transcribe(todo):
+        return chunk_results(model, todo, workers, draft, stats)
+
+    def results_for(chunks):
+        if cache is not None:
+            return cached_chunk_results(cache, chunks, transcribe)
+        return transcribe(chunks)
+
+    with TranscriptWriter(out_dir, result_path=result_path) as out:
+        if cache is not None and cache.complete():
+            print("[INFO] Cache: transcript already complete, skipping decode")
+            write_results(cache.results(), index, out)
+        elif PIPELINE:
+            print("[INFO] Decoding and transcribing (pipelined)...")
+            run_pipeline(audio_path, speakers, results_for, index, out)
+        else:
+            print("[INFO] Chunking audio...")
+            chunks = chunk_audio(audio_path, CHUNK_SECONDS, speakers)
+
+            print("[INFO] Transcribing...")
+            write_results(results_for(chunks), index, out)
 
+    print(f"[INFO] Wrote {out.count} segments")
+    metrics.note("segments", out.count)
 
-    base = "transcript"
-    txt = f"{OUTPUT_DIR}/{base}.txt"
-    srt = f"{OUTPUT_DIR}/{base}.srt"
-    vtt = f"{OUTPUT_DIR}/{base}.vtt"
+    report_escalation(stats)
 
-    with open(txt, "w", encoding="utf-8") as f:
-        for d in diarized:
-            f.write(f"[{d['speaker']}] {d['text']}\n")
+    if cache is not None:
+        evict_cache()
+
+    return out
+
+def main():
+    audio_path = sys.argv[1]
+    emails = sys.argv[2]
 
-    write_srt(diarized, srt)
-    write_vtt(diarized, vtt)
+    check_audio(audio_path)
 
-    with open("result.json", "w") as f:
-        json.dump(diarized, f, indent=2)
+    metrics.start("whisperagent")
+    model = draft = None
+    if not transcript_cached(audio_path):
+        model, draft = load_models()
+    out = run_job(audio_path, model, draft)
 
-    send_email(emails, [txt, srt, vtt])
+    send_email(emails, [out.txt, out.srt, out.vtt])
 
     print("✅ DONE")
 
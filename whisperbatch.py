@@ -0,0 +1,166 @@
+# whisperbatch.py
+# Transcribes many recordings with one loaded model per worker process.
+#
+# Usage: python whisperbatch.py <audio_dir | manifest>
+#
+# A manifest is a text file with one audio path per line (blank lines and
+# lines starting with # are ignored), or a NeMo-style JSONL manifest with an
+# "audio_filepath" per line. Files are scheduled longest-first, so the
+# longest recordings never end up last on an otherwise idle box.
+#
+# Each file gets OUTPUT_DIR/<name>/ with the usual txt/srt/vtt/result.json.
+# If <audio stem>.speakers.json sits next to a file it is used for speakers;
+# `python vadspeaker.py <files...>` writes those for a whole batch in one run.
+import os
+import sys
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import torch
+import whisperagent as wa
+
+# =========================
+# CONFIG
+# =========================
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".flac", ".ogg", ".opus", ".webm", ".mp4", ".aac")
+# Torch threads per worker; the worker count follows from the core count
+BATCH_THREADS = int(os.environ.get("WHISPER_BATCH_THREADS", "4"))
+BATCH_WORKERS = int(os.environ.get("WHISPER_BATCH_WORKERS", "0"))  # 0 = cores // BATCH_THREADS
+SUMMARY_NAME = "batch_summary.json"
+
+# =========================
+# INPUTS
+# =========================
+def list_inputs(source):
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, name)
+            for name in os.listdir(source)
+            if name.lower().endswith(AUDIO_EXTENSIONS)
+        )
+
+    paths = []
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                line = json.loads(line)["audio_filepath"]
+            paths.append(line)
+    return paths
+
+def output_dirs(paths):
+    # OUTPUT_DIR/<stem>, with a numeric suffix when two inputs share a stem
+    seen = {}
+    dirs = []
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        seen[stem] = seen.get(stem, 0) + 1
+        name = stem if seen[stem] == 1 else f"{stem}-{seen[stem]}"
+        dirs.append(os.path.join(wa.OUTPUT_DIR, name))
+    return dirs
+
+def plan_workers(jobs):
+    # Capped at the file count first, so fewer files get more threads each
+    cores = os.cpu_count() or 1
+    workers = min(BATCH_WORKERS or max(1, cores // BATCH_THREADS), max(1, jobs))
+    return workers, max(1, cores // workers)
+
+# =========================
+# WORKERS
+# =========================
+_model = None
+_draft = None
+
+def _init_worker(threads):
+    global _model, _draft
+    torch.set_num_threads(threads)
+    _model, _draft = wa.load_models(workers=1)
+
+def _run_file(path, out_dir, duration):
+    t0 = time.perf_counter()
+    row = {"path": path, "out_dir": out_dir, "duration": duration,
+           "threads": torch.get_num_threads()}
+
+    try:
+        speakers_path = os.path.splitext(path)[0] + ".speakers.json"
+        out = wa.run_job(
+            path, _model, _draft,
+            out_dir=out_dir,
+            result_path=os.path.join(out_dir, "result.json"),
+            speakers_path=speakers_path,
+            workers=1
+        )
+        row.update({"status": "done", "segments": out.count})
+    except Exception as e:
+        row.update({"status": "failed", "error": str(e)})
+
+    row["seconds"] = round(time.perf_counter() - t0, 2)
+    row["rtf"] = round(row["seconds"] / duration, 3) if duration else None
+    return row
+
+# =========================
+# MAIN
+# =========================
+def main():
+    paths = list_inputs(sys.argv[1])
+    if not paths:
+        raise RuntimeError(f"No audio files found in {sys.argv[1]}")
+
+    durations = {}
+    for path in paths:
+        try:
+            durations[path] = wa.get_audio_duration(path)
+        except Exception:
+            print(f"[WARN] Could not probe {path}, scheduling it last")
+            durations[path] = 0.0
+
+    jobs = sorted(zip(paths, output_dirs(paths)), key=lambda j: -durations[j[0]])
+    workers, threads = plan_workers(len(jobs))
+    print(f"[INFO] {len(jobs)} files, {sum(durations.values()):.0f}s of audio, "
+          f"{workers} workers x {threads} threads")
+
+    wa.ensure_dir(wa.OUTPUT_DIR)
+    t0 = time.perf_counter()
+    rows = []
+
+    # The pool hands the next-longest file to whichever worker frees up first
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads,)
+    ) as pool:
+        futures = [
+            pool.submit(_run_file, path, out_dir, durations[path])
+            for path, out_dir in jobs
+        ]
+        for fut in as_completed(futures):
+            row = fut.result()
+            rows.append(row)
+            print(f"[INFO] {row['status']}: {row['path']} in {row['seconds']}s "
+                  f"(RTF {row['rtf']}, {row['threads']} threads)")
+
+    makespan = time.perf_counter() - t0
+    rows.sort(key=lambda r: r["path"])
+
+    print(f"\n{'file':<40} {'audio':>8} {'wall':>8} {'RTF':>6}  status")
+    for r in rows:
+        print(f"{os.path.basename(r['path'])[:40]:<40} {r['duration']:8.1f} "
+              f"{r['seconds']:8.1f} {r['rtf'] if r['rtf'] is not None else '-':>6}  {r['status']}")
+    print(f"[INFO] Makespan {makespan:.1f}s for {sum(durations.values()):.0f}s of audio")
+
+    summary = os.path.join(wa.OUTPUT_DIR, SUMMARY_NAME)
+    with open(summary, "w") as f:
+        json.dump({
+            "workers": workers,
+            "threads_per_worker": threads,
+            "makespan": round(makespan, 2),
+            "files": rows
+        }, f, indent=2)
+    print(f"✅ Summary written to {summary}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,867 @@
+# whisperbench.py
+# Usage:
+#   python whisperbench.py parallel <audio_path> [model_size] [workers,...]
+#   python whisperbench.py speakers [turns] [segments]
+#   python whisperbench.py quantize <audio_path> [model_size] [reference.txt]
+#   python whisperbench.py batched <audio_path> [model_size] [batch,...]
+#   python whisperbench.py longaudio [hours,...]
+#   python whisperbench.py segments [hours]
+#   python whisperbench.py suite [seconds,...] [model_size|none] [results.jsonl]
+#   python whisperbench.py diarize [seconds,...] [profile,...]
+#   python whisperbench.py quiet [speech_seconds] [quiet_seconds]
+#
+# "suite" is the offline regression run: synthetic multi-speaker audio, then
+# chunk_audio, transcribe_chunks, find_speaker and the SRT/VTT writers at each
+# duration. Every run appends one JSON line to the results file and is
+# compared with the previous run on the same machine. The model must already
+# be in the Whisper download cache (or be given as a checkpoint path).
+#
+# "longaudio" fails if the long-audio mode's peak RSS grows by more than
+# LONGAUDIO_MARGIN_MB from the shortest to the longest recording.
+#
+# "quiet" checks that the pipelined planner skips a long low-noise tail the
+# way whole-file planning does, with and without the audio cache.
+#
+# "diarize" needs NeMo: each vadspeaker.py profile diarizes the same
+# synthetic multi-speaker fixtures, reporting wall time and DER.
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+import random
+import tempfile
+import threading
+import resource
+import tracemalloc
+import multiprocessing
+import numpy as np
+import torch
+import whisper
+import audiocache
+import metrics
+import speakerstore
+import whisperagent as wa
+
+# =========================
+# CONFIG
+# =========================
+DEFAULT_MODEL = "tiny"
+DEFAULT_WORKERS = "2,4"
+DEFAULT_BATCHES = "4,8"
+DEFAULT_HOURS = "1,4"
+# Long-audio peak RSS growth may rise by at most this much from the shortest
+# to the longest recording
+LONGAUDIO_MARGIN_MB = 32
+DEFAULT_STORE_HOURS = 10
+DEFAULT_SUITE_SECONDS = "30,120,600"
+DEFAULT_RESULTS = "bench_results.jsonl"
+SUITE_SPEAKERS = 3
+SUITE_REPEATS = 5
+LOOKUPS_PER_SECOND = 10     # find_speaker calls per second of audio
+REGRESSION_RATIO = 1.10     # slower than this vs the previous run is flagged...
+REGRESSION_MIN_SECONDS = 0.002  # ...unless the difference is below timer noise
+DEFAULT_TURNS = 10_000
+DEFAULT_SEGMENTS = 50_000
+LINEAR_SAMPLE = 500  # the old linear scan is timed on a sample and extrapolated
+DEFAULT_DIARIZE_SECONDS = "60,300"
+DEFAULT_QUIET = (300, 600)  # seconds of speech, then of low-level noise
+QUIET_TOLERANCE = 0.05  # skipped seconds may differ from chunk_audio's by this fraction
+DEFAULT_PROFILES = "fast,balanced,accurate"
+DER_FRAME = 0.01  # seconds; DER is scored frame by frame, without a collar
+
+# =========================
+# FIXTURES
+# =========================
+def synthetic_turns(n, speakers=4, seed=0):
+    rng = random.Random(seed)
+    turns, t = [], 0.0
+    for _ in range(n):
+        t += rng.uniform(0.0, 0.5)
+        length = rng.uniform(0.5, 8.0)
+        turns.append({
+            "speaker": f"speaker_{rng.randrange(speakers)}",
+            "start": t,
+            "end": t + length
+        })
+        t += length
+    return turns
+
+def synthetic_segments(n, duration, seed=1):
+    rng = random.Random(seed)
+    segs = []
+    for _ in range(n):
+        start = rng.uniform(0.0, duration)
+        segs.append({"start": start, "end": start + rng.uniform(0.5, 6.0)})
+    return segs
+
+def wav_header(n):
+    # 16 kHz mono s16 PCM, n samples
+    return (
+        b"RIFF" + (36 + 2 * n).to_bytes(4, "little") + b"WAVE"
+        + b"fmt " + (16).to_bytes(4, "little") + (1).to_bytes(2, "little")
+        + (1).to_bytes(2, "little") + wa.SAMPLE_RATE.to_bytes(4, "little")
+        + (2 * wa.SAMPLE_RATE).to_bytes(4, "little")
+        + (2).to_bytes(2, "little") + (16).to_bytes(2, "little")
+        + b"data" + (2 * n).to_bytes(4, "little")
+    )
+
+def write_synthetic_wav(path, seconds, seed=0):
+    # 16 kHz mono s16: noise bursts of 2-20 s ("speech") between 0.5-4 s
+    # pauses, written block by block so the fixture itself stays small
+    rng = np.random.default_rng(seed)
+    n = int(seconds * wa.SAMPLE_RATE)
+    with open(path, "wb") as f:
+        f.write(wav_header(n))
+
+        written = 0
+        while written < n:
+            speech = min(int(rng.uniform(2, 20) * wa.SAMPLE_RATE), n - written)
+            pause = min(int(rng.uniform(0.5, 4) * wa.SAMPLE_RATE), n - written - speech)
+            block = np.zeros(speech + pause, np.int16)
+            block[:speech] = rng.normal(0, 3000, speech).clip(-32768, 32767)
+            f.write(block.tobytes())
+            written += len(block)
+
+def write_multispeaker_wav(path, seconds, speakers=SUITE_SPEAKERS, seed=0):
+    """Turn-taking "voices" and the ground-truth turns, as speakers.json rows.
+
+    Each speaker is a harmonic tone at its own pitch, amplitude-modulated
+    at a syllable-like rate; turns of 1-12 s are separated by 0.2-2 s gaps.
+    """
+    rng = np.random.default_rng(seed)
+    sr = wa.SAMPLE_RATE
+    n = int(seconds * sr)
+    pitches = [110.0 * 1.35 ** k for k in range(speakers)]
+    turns = []
+
+    with open(path, "wb") as f:
+        f.write(wav_header(n))
+        written = 0
+        while written < n:
+            speaker = int(rng.integers(speakers))
+            length = min(int(rng.uniform(1, 12) * sr), n - written)
+            gap = min(int(rng.uniform(0.2, 2) * sr), n - written - length)
+
+            t = np.arange(length) / sr
+            f0 = pitches[speaker] * (1 + 0.03 * np.sin(2 * np.pi * 0.5 * t))
+            phase = 2 * np.pi * np.cumsum(f0) / sr
+            voice = sum(np.sin(h * phase) / h for h in range(1, 6))
+            envelope = 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(3, 5) * t) ** 2
+            block = np.zeros(length + gap, np.float32)
+            block[:length] = 0.2 * voice * envelope + rng.normal(0, 0.005, length)
+
+            f.write((block * 32767).clip(-32768, 32767).astype(np.int16).tobytes())
+            turns.append({
+                "speaker": f"speaker_{speaker}",
+                "start": written / sr,
+                "end": (written + length) / sr
+            })
+            written += len(block)
+
+    return turns
+
+def write_quiet_tail_wav(path, speech_seconds, quiet_seconds, seed=0):
+    # Multi-speaker audio, then a tail of noise ~50 dB below it: every
+    # pipeline block in the tail is entirely quiet
+    speech_path = path + ".speech.wav"
+    write_multispeaker_wav(speech_path, speech_seconds, seed=seed)
+    speech = np.fromfile(speech_path, np.int16, offset=44)
+    os.remove(speech_path)
+
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(0, 20, int(quiet_seconds * wa.SAMPLE_RATE)).astype(np.int16)
+    with open(path, "wb") as f:
+        f.write(wav_header(len(speech) + len(noise)))
+        f.write(speech.tobytes())
+        f.write(noise.tobytes())
+
+WORDS = ("the", "we", "budget", "quarter", "so", "actually", "customer", "think",
+         "release", "yes", "meeting", "Thursday", "numbers", "okay", "plan", "team")
+
+def synthetic_whisper_segments(seconds, seed=2):
+    # Segments as model.transcribe() returns them, about one per 4 s of speech
+    rng = random.Random(seed)
+    segs, t = [], 0.0
+    while t < seconds:
+        length = rng.uniform(1.5, 7.0)
+        words = [rng.choice(WORDS) for _ in range(int(length * 2.5))]
+        segs.append({
+            "id": len(segs), "seek": int(t * 100), "start": t, "end": t + length,
+            "text": " " + " ".join(words),
+            "tokens": [rng.randrange(50257) for _ in range(int(len(words) * 1.3))],
+            "temperature": 0.0, "avg_logprob": rng.uniform(-1.0, -0.1),
+            "compression_ratio": rng.uniform(1.0, 2.4), "no_speech_prob": rng.random()
+        })
+        t += length + rng.uniform(0.0, 1.0)
+    return segs
+
+class StubModel:
+    """Whisper-shaped output (tokens and all) at no inference cost."""
+
+    def transcribe(self, audio, **kwargs):
+        duration = len(audio) / wa.SAMPLE_RATE
+        level = float(np.abs(audio).mean())
+        return {"segments": [
+            {
+                "id": i, "seek": 0, "start": t, "end": min(t + 5.0, duration),
+                "text": f" segment at {t:.0f}s, level {level:.4f}",
+                "tokens": list(range(50364, 50364 + 40)),
+                "temperature": 0.0, "avg_logprob": -0.3,
+                "compression_ratio": 1.4, "no_speech_prob": 0.01
+            }
+            for i, t in enumerate(np.arange(0, duration, 5.0).tolist())
+        ]}
+
+# =========================
+# BENCHMARKS
+# =========================
+def linear_find_speaker(start, end, speakers):
+    # Pre-index find_speaker: full scan, strict containment
+    for s in speakers:
+        if start >= s["start"] and end <= s["end"]:
+            return s["speaker"]
+    return "UNKNOWN"
+
+def bench_speakers(n_turns, n_segments):
+    turns = synthetic_turns(n_turns)
+    segments = synthetic_segments(n_segments, turns[-1]["end"])
+
+    sample = segments[:LINEAR_SAMPLE]
+    t0 = time.perf_counter()
+    linear = [linear_find_speaker(s["start"], s["end"], turns) for s in sample]
+    linear_s = (time.perf_counter() - t0) * n_segments / len(sample)
+
+    t0 = time.perf_counter()
+    index = wa.SpeakerIndex(turns)
+    build_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    swept = wa.assign_speakers(segments, index)
+    sweep_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    found = [wa.find_speaker(s["start"], s["end"], index) for s in segments]
+    find_s = time.perf_counter() - t0
+
+    assert swept == found, "sweep and per-segment lookups disagree"
+
+    unknown_linear = linear.count("UNKNOWN") / len(linear)
+    unknown_index = swept.count("UNKNOWN") / len(swept)
+    print(f"[BENCH] {n_turns} turns x {n_segments} segments")
+    print(f"[BENCH] linear scan  : {linear_s:8.2f}s (extrapolated)  UNKNOWN {unknown_linear:.1%}")
+    print(f"[BENCH] index build  : {build_s:8.3f}s")
+    print(f"[BENCH] sweep assign : {sweep_s:8.3f}s  UNKNOWN {unknown_index:.1%}  x{linear_s / sweep_s:.0f}")
+    print(f"[BENCH] bisect find  : {find_s:8.3f}s  x{linear_s / find_s:.0f}")
+
+    # speakers.json through json.load vs its speakers.npz twin
+    with tempfile.TemporaryDirectory(prefix="whisperbench-") as tmp:
+        json_path = os.path.join(tmp, "speakers.json")
+        with open(json_path, "w") as f:
+            json.dump(turns, f, indent=2)
+
+        t0 = time.perf_counter()
+        with open(json_path) as f:
+            loaded = json.load(f)
+        wa.SpeakerIndex(loaded)
+        json_s = time.perf_counter() - t0
+
+        speakerstore.SpeakerSegments.from_turns(turns).save(
+            speakerstore.npz_path(json_path), speakerstore.fingerprint(json_path)
+        )
+        t0 = time.perf_counter()
+        stored = wa.load_speakers(json_path)
+        npz_index = wa.SpeakerIndex(stored)
+        npz_s = time.perf_counter() - t0
+
+        assert wa.assign_speakers(segments, npz_index) == swept, "NPZ turns assign differently"
+        json_kb = os.path.getsize(json_path) / 1024
+        npz_kb = os.path.getsize(speakerstore.npz_path(json_path)) / 1024
+
+        # Another recording's JSON copied in with its (older) mtime kept,
+        # as cp -p or rclone do: the leftover NPZ must not win
+        other = turns[: len(turns) // 2]
+        with open(json_path, "w") as f:
+            json.dump(other, f)
+        old = os.path.getmtime(speakerstore.npz_path(json_path)) - 3600
+        os.utime(json_path, (old, old))
+        assert len(wa.load_speakers(json_path)) == len(other), "stale speakers.npz was used"
+
+    print(f"[BENCH] json load+index: {json_s:8.3f}s  {json_kb:8.0f} KB")
+    print(f"[BENCH] npz load+index : {npz_s:8.3f}s  {npz_kb:8.0f} KB  x{json_s / npz_s:.0f}")
+
+def word_errors(ref, hyp):
+    # Word-level Levenshtein distance
+    ref, hyp = ref.lower().split(), hyp.lower().split()
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i]
+        for j, h in enumerate(hyp, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h)))
+        prev = cur
+    return prev[-1], len(ref)
+
+def wer(ref, hyp):
+    errors, words = word_errors(ref, hyp)
+    return errors / max(words, 1)
+
+def speaker_frames(turns, n_frames):
+    # (frames x speakers) activity matrix
+    labels = sorted({t["speaker"] for t in turns})
+    col = {label: i for i, label in enumerate(labels)}
+    active = np.zeros((n_frames, len(labels)), bool)
+    for t in turns:
+        active[int(round(t["start"] / DER_FRAME)):int(round(t["end"] / DER_FRAME)), col[t["speaker"]]] = True
+    return active
+
+def best_overlap(overlap):
+    # Largest total overlap under a one-to-one speaker mapping; a DP over
+    # subsets of the (at most max_num_speakers) columns, exact unlike greedy
+    if overlap.shape[0] < overlap.shape[1]:
+        overlap = overlap.T
+    best = {0: 0}
+    for row in overlap:
+        step = dict(best)
+        for mask, score in best.items():
+            for j, value in enumerate(row):
+                if not mask >> j & 1 and score + value > step.get(mask | 1 << j, -1):
+                    step[mask | 1 << j] = score + value
+        best = step
+    return max(best.values())
+
+def der(reference, hypothesis):
+    """Diarization error rate and its parts, as fractions of reference speech."""
+    end = max(t["end"] for t in [*reference, *hypothesis])
+    n_frames = int(end / DER_FRAME) + 1
+    ref = speaker_frames(reference, n_frames)
+    hyp = speaker_frames(hypothesis, n_frames) if hypothesis else np.zeros((n_frames, 0), bool)
+
+    n_ref, n_hyp = ref.sum(1), hyp.sum(1)
+    matched = best_overlap(ref.T.astype(np.int64) @ hyp.astype(np.int64)) if hyp.shape[1] else 0
+    total = max(int(n_ref.sum()), 1)
+    return {
+        "der": float(np.maximum(n_ref, n_hyp).sum() - matched) / total,
+        "miss": float(np.maximum(n_ref - n_hyp, 0).sum()) / total,
+        "false_alarm": float(np.maximum(n_hyp - n_ref, 0).sum()) / total,
+        "confusion": float(np.minimum(n_ref, n_hyp).sum() - matched) / total
+    }
+
+def _quant_run(audio_path, model_size, quantize, out):
+    # Runs in a fresh process so ru_maxrss is this path's own peak
+    t0 = time.perf_counter()
+    model = wa.load_whisper(model_size, quantize=quantize)
+    load_s = time.perf_counter() - t0
+
+    chunks = wa.chunk_audio(audio_path, wa.CHUNK_SECONDS)
+    t0 = time.perf_counter()
+    text = " ".join(s["text"].strip() for s in wa.transcribe_chunks(model, chunks))
+    out.put({
+        "load_s": load_s,
+        "run_s": time.perf_counter() - t0,
+        "audio_s": sum(len(c) for c, _ in chunks) / wa.SAMPLE_RATE,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "text": text
+    })
+
+def quant_run(audio_path, model_size, quantize):
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    proc = ctx.Process(target=_quant_run, args=(audio_path, model_size, quantize, out))
+    proc.start()
+    result = out.get()
+    proc.join()
+    return result
+
+def bench_quantize(audio_path, model_size, reference_path=None):
+    fp32 = quant_run(audio_path, model_size, False)
+    # Twice: the first int8 run quantizes and saves, the second loads the cache
+    int8_cold = quant_run(audio_path, model_size, True)
+    int8 = quant_run(audio_path, model_size, True)
+
+    for name, r in (("fp32", fp32), ("int8 cold", int8_cold), ("int8", int8)):
+        print(
+            f"[BENCH] {name:<9}: load {r['load_s']:6.1f}s  "
+            f"RTF {r['run_s'] / r['audio_s']:.3f}  "
+            f"peak RSS {r['peak_rss_mb']:.0f} MB"
+        )
+
+    print(f"[BENCH] WER int8 vs fp32 output: {wer(fp32['text'], int8['text']):.2%}")
+
+    if reference_path:
+        with open(reference_path, encoding="utf-8") as f:
+            reference = f.read()
+        fp32_wer, int8_wer = wer(reference, fp32["text"]), wer(reference, int8["text"])
+        print(
+            f"[BENCH] WER vs reference: fp32 {fp32_wer:.2%}  int8 {int8_wer:.2%}  "
+            f"diff {int8_wer - fp32_wer:+.2%}"
+        )
+
+def bench_parallel(audio_path, model_size, worker_counts):
+    chunks = wa.chunk_audio(audio_path, wa.CHUNK_SECONDS)
+    audio_seconds = sum(len(c) for c, _ in chunks) / wa.SAMPLE_RATE
+
+    # Serial baseline: model load is excluded, as in a warm run
+    model = wa.load_whisper(model_size)
+    t0 = time.perf_counter()
+    serial = list(wa.transcribe_chunks(model, chunks))
+    serial_s = time.perf_counter() - t0
+    del model
+
+    print(f"[BENCH] serial    : {serial_s:8.2f}s  RTF {serial_s / audio_seconds:.3f}")
+
+    serial_text = [s["text"] for s in serial]
+    for workers in worker_counts:
+        # Parallel includes per-worker model load, which is what a real run pays
+        t0 = time.perf_counter()
+        parallel = [
+            seg
+            for _, segs in wa.transcribe_chunks_parallel(chunks, workers, model_size=model_size)
+            for seg in segs
+        ]
+        parallel_s = time.perf_counter() - t0
+
+        same = [s["text"] for s in parallel] == serial_text
+        print(
+            f"[BENCH] workers={workers:<2}: {parallel_s:8.2f}s  "
+            f"RTF {parallel_s / audio_seconds:.3f}  "
+            f"speedup x{serial_s / parallel_s:.2f}  "
+            f"{'identical' if same else 'DIFFERENT'} output"
+        )
+
+def _rss_run(audio_path, work_dir, out):
+    # Fresh process per run; VmRSS is sampled because ru_maxrss would also
+    # count the one-off ffmpeg normalization, which is not ours
+    peak = 0
+    stop = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not stop.is_set():
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        peak = max(peak, int(line.split()[1]))
+            stop.wait(0.05)
+
+    audiocache.normalized_audio(audio_path)
+    with open("/proc/self/status") as f:
+        base = next(int(l.split()[1]) for l in f if l.startswith("VmRSS:"))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    t0 = time.perf_counter()
+    writer = wa.run_job(
+        audio_path, StubModel(),
+        out_dir=work_dir,
+        result_path=os.path.join(work_dir, "result.json"),
+        speakers_path=os.path.join(work_dir, "speakers.json"),
+        workers=1
+    )
+    stop.set()
+    sampler.join()
+    out.put({
+        "seconds": time.perf_counter() - t0,
+        "segments": writer.count,
+        "base_mb": base / 1024,
+        "peak_mb": peak / 1024
+    })
+
+def run_isolated(target, args, env):
+    # Runs target(*args, out) in a spawned process; spawned children read
+    # the config from the environment at import, so env is set around it
+    ctx = multiprocessing.get_context("spawn")
+    saved = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    try:
+        out = ctx.Queue()
+        proc = ctx.Process(target=target, args=(*args, out))
+        proc.start()
+        result = out.get()
+        proc.join()
+        return result
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+def bench_longaudio(hours_list):
+    with tempfile.TemporaryDirectory(prefix="whisperbench-") as tmp:
+        env = {
+            "AUDIO_CACHE_DIR": os.path.join(tmp, "audio"),
+            "AUDIO_CACHE_MAX_MB": str(1 << 20),
+            "WHISPER_CACHE_MAX_MB": str(1 << 20),
+        }
+        modes = (
+            ("whole-file", {"WHISPER_LONG_AUDIO": "0", "WHISPER_PIPELINE": "0"}),
+            ("long-audio", {"WHISPER_LONG_AUDIO": "1", "WHISPER_PIPELINE": "1"}),
+        )
+        growth = {}
+        for hours in hours_list:
+            audio_path = os.path.join(tmp, f"synthetic-{hours}h.wav")
+            write_synthetic_wav(audio_path, hours * 3600)
+
+            for name, mode_env in modes:
+                work_dir = tempfile.mkdtemp(dir=tmp)
+                # Each run gets its own transcript cache, so nothing is reused
+                run_env = {**env, **mode_env, "WHISPER_CACHE_DIR": os.path.join(work_dir, "cache")}
+                r = run_isolated(_rss_run, (audio_path, work_dir), run_env)
+
+                print(
+                    f"[BENCH] {hours:>4}h {name:<10}: {r['seconds']:7.1f}s  "
+                    f"{r['segments']:6d} segments  "
+                    f"peak RSS {r['peak_mb']:6.0f} MB (+{r['peak_mb'] - r['base_mb']:.0f} MB over start)"
+                )
+                if name == "long-audio":
+                    growth[hours] = r["peak_mb"] - r["base_mb"]
+
+        # Long-audio memory must not scale with the recording
+        short, long = growth[min(growth)], growth[max(growth)]
+        assert long - short <= LONGAUDIO_MARGIN_MB, \
+            f"long-audio peak grew {short:.0f} MB -> {long:.0f} MB from {min(growth)}h to {max(growth)}h"
+
+def traced(build):
+    # (result, bytes still allocated by build)
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+def bench_store(hours):
+    seconds = hours * 3600
+    turns = synthetic_turns(int(seconds / 4))
+    index = wa.SpeakerIndex(turns)
+
+    # Old shape: every Whisper dict kept, then a second list of diarized rows
+    segs, whisper_bytes = traced(lambda: synthetic_whisper_segments(seconds))
+    diarized, diarized_bytes = traced(lambda: [wa.diarize(s, index) for s in segs])
+
+    def build_store():
+        store = wa.SegmentStore()
+        store.extend(segs)
+        store.assign(index)
+        return store
+
+    store, store_bytes = traced(build_store)
+    assert list(store) == diarized, "store rows differ from diarize()"
+
+    old = whisper_bytes + diarized_bytes
+    print(f"[BENCH] {hours}h, {len(segs)} segments")
+    print(f"[BENCH] whisper dicts  : {whisper_bytes / 2**20:8.1f} MB")
+    print(f"[BENCH] diarized dicts : {diarized_bytes / 2**20:8.1f} MB")
+    print(f"[BENCH] segment store  : {store_bytes / 2**20:8.1f} MB "
+          f"({store.nbytes() / 2**20:.1f} MB of arrays and text)  "
+          f"x{old / store_bytes:.0f} smaller")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        wa.write_srt(diarized, os.path.join(tmp, "dicts.srt"))
+        dicts_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        wa.write_srt(store, os.path.join(tmp, "store.srt"))
+        store_s = time.perf_counter() - t0
+        with open(os.path.join(tmp, "dicts.srt")) as a, open(os.path.join(tmp, "store.srt")) as b:
+            same = a.read() == b.read()
+    print(f"[BENCH] write_srt      : dicts {dicts_s:.3f}s  store {store_s:.3f}s  "
+          f"{'identical' if same else 'DIFFERENT'} output")
+
+def _suite_run(audio_path, turns, seconds, model_size, work_dir, out):
+    # Fast stages keep the best of SUITE_REPEATS runs; peak RSS comes from
+    # one metrics span around all of them
+    metrics.start("suite")
+    stages = {}
+
+    def measure(name, fn, repeats=SUITE_REPEATS, audio_seconds=None, items=None):
+        times = []
+        with metrics.span(name):
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                result = fn()
+                times.append(time.perf_counter() - t0)
+        stage = {"seconds": min(times), "repeats": repeats}
+        if audio_seconds:
+            stage["audio_seconds"] = round(audio_seconds, 2)
+            stage["rtf"] = stage["seconds"] / audio_seconds
+        if items is not None:
+            stage["items"] = items
+            stage["items_per_second"] = round(items / max(stage["seconds"], 1e-9), 1)
+        stages[name] = stage
+        return result
+
+    # Normalization is a one-off per file: keep it out of chunk_audio
+    wa.normalized_audio(audio_path)
+    chunks = measure("chunk_audio", lambda: wa.chunk_audio(audio_path, wa.CHUNK_SECONDS),
+                     audio_seconds=seconds)
+    stages["chunk_audio"]["chunks"] = len(chunks)
+
+    if model_size != "none":
+        model = wa.load_whisper(model_size)
+        speech = sum(len(c) for c, _ in chunks) / wa.SAMPLE_RATE
+        torch.manual_seed(0)
+        segs = measure("transcribe_chunks", lambda: list(wa.transcribe_chunks(model, chunks)),
+                       repeats=1, audio_seconds=speech)
+        stages["transcribe_chunks"]["segments"] = len(segs)
+
+    index = wa.SpeakerIndex(turns)
+    lookups = synthetic_segments(int(seconds * LOOKUPS_PER_SECOND), seconds)
+    measure("find_speaker", lambda: [
+        wa.find_speaker(seg["start"], seg["end"], index) for seg in lookups
+    ], items=len(lookups))
+
+    store = wa.SegmentStore()
+    store.extend(synthetic_whisper_segments(seconds))
+    store.assign(index)
+    for name, write in (("write_srt", wa.write_srt), ("write_vtt", wa.write_vtt)):
+        path = os.path.join(work_dir, f"transcript.{name[-3:]}")
+        measure(name, lambda: write(store, path), items=len(store))
+
+    summary = metrics.finish(os.path.join(work_dir, "metrics.json"))
+    for name, stage in stages.items():
+        stage["peak_rss_mb"] = summary["stages"][name]["peak_rss_mb"]
+    out.put(stages)
+
+def git_version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def machine_info():
+    return {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "whisper": getattr(whisper, "__version__", "unknown"),
+    }
+
+def previous_run(results_path, record):
+    # Last earlier run on the same machine with the same model
+    if not os.path.exists(results_path):
+        return None
+    prev = None
+    with open(results_path) as f:
+        for line in f:
+            try:
+                run = json.loads(line)
+            except ValueError:
+                continue
+            if run.get("machine") == record["machine"] and run.get("model") == record["model"]:
+                prev = run
+    return prev
+
+def compare_runs(prev, record):
+    print(f"[BENCH] vs {prev['version']} ({time.strftime('%Y-%m-%d %H:%M', time.localtime(prev['time']))})")
+    for duration, stages in record["durations"].items():
+        old_stages = prev["durations"].get(duration, {})
+        for name, stage in stages.items():
+            old = old_stages.get(name)
+            if old is None or not old["seconds"]:
+                continue
+            ratio = stage["seconds"] / old["seconds"]
+            slower = ratio > REGRESSION_RATIO \
+                and stage["seconds"] - old["seconds"] > REGRESSION_MIN_SECONDS
+            print(f"[BENCH] {duration:>6}s {name:<18}: {old['seconds'] * 1000:10.2f} ms -> "
+                  f"{stage['seconds'] * 1000:10.2f} ms  x{ratio:.2f}{'  REGRESSION' if slower else ''}")
+
+def bench_suite(durations, model_size, results_path):
+    record = {
+        "version": git_version(),
+        "time": time.time(),
+        "model": model_size,
+        "machine": machine_info(),
+        "durations": {},
+        "fixtures": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="whisperbench-") as tmp:
+        env = {
+            "AUDIO_CACHE_DIR": os.path.join(tmp, "audio"),
+            "AUDIO_CACHE_MAX_MB": str(1 << 20),
+            "WHISPER_CACHE_DIR": "",
+            "WHISPER_PROFILE": "",
+        }
+        for seconds in durations:
+            audio_path = os.path.join(tmp, f"speakers-{seconds:g}s.wav")
+            turns = write_multispeaker_wav(audio_path, seconds)
+            record["fixtures"][f"{seconds:g}"] = audiocache.file_sha256(audio_path)[:16]
+
+            # One fresh process per duration, so peak RSS is that run's own
+            work_dir = tempfile.mkdtemp(dir=tmp)
+            stages = run_isolated(_suite_run, (audio_path, turns, seconds, model_size, work_dir), env)
+            record["durations"][f"{seconds:g}"] = stages
+
+            for name, stage in stages.items():
+                line = f"[BENCH] {seconds:>6g}s {name:<18}: {stage['seconds'] * 1000:10.2f} ms"
+                if "rtf" in stage:
+                    line += f"  RTF {stage['rtf']:.5f}"
+                if "items" in stage:
+                    line += f"  {stage['items_per_second']:>10.0f}/s"
+                print(line + f"  peak {stage['peak_rss_mb']:.0f} MB")
+
+    prev = previous_run(results_path, record)
+    with open(results_path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"[BENCH] Results appended to {results_path}")
+
+    if prev is not None:
+        compare_runs(prev, record)
+
+def segment_key(s):
+    return (round(s["start"], 2), round(s["end"], 2), s["text"])
+
+def bench_batched(audio_path, model_size, batch_sizes):
+    chunks = wa.chunk_audio(audio_path, wa.CHUNK_SECONDS)
+    audio_seconds = sum(len(c) for c, _ in chunks) / wa.SAMPLE_RATE
+    model = wa.load_whisper(model_size)
+
+    # Temperature fallback samples, so both paths start from the same RNG state
+    torch.manual_seed(0)
+    t0 = time.perf_counter()
+    serial = list(wa.transcribe_chunks(model, chunks))
+    serial_s = time.perf_counter() - t0
+    print(f"[BENCH] batch=1  : {serial_s:8.2f}s  RTF {serial_s / audio_seconds:.3f}")
+
+    serial_keys = [segment_key(s) for s in serial]
+    for batch_size in batch_sizes:
+        torch.manual_seed(0)
+        t0 = time.perf_counter()
+        batched = [
+            seg
+            for _, segs in wa.transcribe_chunks_batched(model, chunks, batch_size)
+            for seg in segs
+        ]
+        batched_s = time.perf_counter() - t0
+
+        same = [segment_key(s) for s in batched] == serial_keys
+        print(
+            f"[BENCH] batch={batch_size:<3}: {batched_s:8.2f}s  "
+            f"RTF {batched_s / audio_seconds:.3f}  "
+            f"speedup x{serial_s / batched_s:.2f}  "
+            f"{'identical' if same else 'DIFFERENT'} segments"
+        )
+
+def _plan_run(audio_path, total, out):
+    # Chunk plans only, no model: (skipped seconds, chunks, last offset)
+    def summary(chunks):
+        kept = sum(len(c) for c, _ in chunks) / wa.SAMPLE_RATE
+        return total - kept, len(chunks), max(o for _, o in chunks)
+
+    out.put({
+        "chunk_audio": summary(wa.chunk_audio(audio_path, wa.CHUNK_SECONDS)),
+        "stream_chunks": summary([(c.copy(), o) for c, o in wa.stream_chunks(audio_path, wa.CHUNK_SECONDS)])
+    })
+
+def bench_quiet(speech_seconds, quiet_seconds):
+    with tempfile.TemporaryDirectory(prefix="whisperbench-") as tmp:
+        audio_path = os.path.join(tmp, "quiet-tail.wav")
+        write_quiet_tail_wav(audio_path, speech_seconds, quiet_seconds)
+        print(f"[BENCH] {speech_seconds:g}s speech + {quiet_seconds:g}s low-level noise")
+
+        for name, cache_dir in (("audio cache", os.path.join(tmp, "audio")), ("ffmpeg pipe", "")):
+            r = run_isolated(_plan_run, (audio_path, speech_seconds + quiet_seconds), {
+                "AUDIO_CACHE_DIR": cache_dir,
+                "WHISPER_LONG_AUDIO": "0",
+                "WHISPER_SPEECH_SOURCE": "energy"
+            })
+            whole, streamed = r["chunk_audio"], r["stream_chunks"]
+            for label, (skipped, chunks, last) in (("chunk_audio", whole), ("stream_chunks", streamed)):
+                print(f"[BENCH] {name:<11} {label:<13}: skipped {skipped:7.1f}s  "
+                      f"{chunks:3d} chunks  last offset {last:6.1f}s")
+            assert abs(streamed[0] - whole[0]) <= QUIET_TOLERANCE * whole[0], \
+                f"{name}: stream_chunks skips {streamed[0]:.1f}s, chunk_audio {whole[0]:.1f}s"
+
+def bench_diarize(durations, profiles):
+    import vadspeaker
+
+    with tempfile.TemporaryDirectory(prefix="whisperbench-") as tmp:
+        fixtures = []
+        for seconds in durations:
+            path = os.path.join(tmp, f"speakers-{seconds:g}s.wav")
+            turns = write_multispeaker_wav(path, seconds)
+            # Decode outside the timed runs
+            audiocache.normalized_audio(path)
+            fixtures.append((seconds, path, turns))
+
+        for profile in profiles:
+            work_dir = os.path.join(tmp, profile)
+            os.makedirs(work_dir)
+            # No embedding cache, so every run extracts its own
+            diarizer = vadspeaker.Diarizer(
+                manifest_path=os.path.join(work_dir, "manifest.json"),
+                out_dir=work_dir,
+                cache_dir="",
+                profile=profile
+            )
+            t0 = time.perf_counter()
+            diarizer.load()
+            print(f"[BENCH] {profile:<8} model load {time.perf_counter() - t0:6.1f}s  "
+                  f"{diarizer.threads} threads")
+
+            for seconds, path, turns in fixtures:
+                t0 = time.perf_counter()
+                hyp = diarizer.run([path])[path]
+                wall = time.perf_counter() - t0
+                score = der(turns, hyp)
+                print(
+                    f"[BENCH] {profile:<8} {seconds:6.0f}s: {wall:7.1f}s  RTF {wall / seconds:.3f}  "
+                    f"{diarizer.threads} threads  "
+                    f"DER {score['der']:6.1%} (miss {score['miss']:.1%}, "
+                    f"FA {score['false_alarm']:.1%}, confusion {score['confusion']:.1%})  "
+                    f"{len({t['speaker'] for t in hyp})}/{len({t['speaker'] for t in turns})} speakers"
+                )
+
+# =========================
+# MAIN
+# =========================
+def main():
+    mode = sys.argv[1]
+    args = sys.argv[2:]
+
+    if mode == "parallel":
+        model_size = args[1] if len(args) > 1 else DEFAULT_MODEL
+        workers = args[2] if len(args) > 2 else DEFAULT_WORKERS
+        bench_parallel(args[0], model_size, [int(w) for w in workers.split(",")])
+    elif mode == "speakers":
+        n_turns = int(args[0]) if len(args) > 0 else DEFAULT_TURNS
+        n_segments = int(args[1]) if len(args) > 1 else DEFAULT_SEGMENTS
+        bench_speakers(n_turns, n_segments)
+    elif mode == "quantize":
+        model_size = args[1] if len(args) > 1 else DEFAULT_MODEL
+        bench_quantize(args[0], model_size, args[2] if len(args) > 2 else None)
+    elif mode == "batched":
+        model_size = args[1] if len(args) > 1 else DEFAULT_MODEL
+        batches = args[2] if len(args) > 2 else DEFAULT_BATCHES
+        bench_batched(args[0], model_size, [int(b) for b in batches.split(",")])
+    elif mode == "segments":
+        bench_store(float(args[0]) if args else DEFAULT_STORE_HOURS)
+    elif mode == "suite":
+        durations = args[0] if args else DEFAULT_SUITE_SECONDS
+        model_size = args[1] if len(args) > 1 else DEFAULT_MODEL
+        results_path = args[2] if len(args) > 2 else DEFAULT_RESULTS
+        bench_suite([float(d) for d in durations.split(",")], model_size, results_path)
+    elif mode == "longaudio":
+        hours = args[0] if args else DEFAULT_HOURS
+        bench_longaudio([float(h) for h in hours.split(",")])
+    elif mode == "quiet":
+        speech = float(args[0]) if args else DEFAULT_QUIET[0]
+        quiet = float(args[1]) if len(args) > 1 else DEFAULT_QUIET[1]
+        bench_quiet(speech, quiet)
+    elif mode == "diarize":
+        durations = args[0] if args else DEFAULT_DIARIZE_SECONDS
+        profiles = args[1] if len(args) > 1 else DEFAULT_PROFILES
+        bench_diarize([float(d) for d in durations.split(",")], profiles.split(","))
+    else:
+        raise SystemExit(f"Unknown benchmark: {mode}")
+
+if __name__ == "__main__":
+    main()
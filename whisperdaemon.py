@@ -0,0 +1,181 @@
+# whisperdaemon.py
+# Long-lived whisperagent worker: loads the model(s) once, then runs jobs in
+# arrival order.
+#
+# Usage:
+#   python whisperdaemon.py spool [spool_dir]
+#   python whisperdaemon.py socket [socket_path]
+#
+# A job is a JSON object:
+#   {"audio_path": "...", "emails": "a@b.c", "speakers_path": "...", "id": "..."}
+# Only audio_path is required. Outputs go to OUTPUT_DIR/<id>/; an id may not
+# contain a path separator. speakers_path defaults to <stem>.speakers.json
+# beside the audio; without that file speakers are UNKNOWN.
+#
+# Spool mode: drop <name>.json into <spool_dir>/incoming (write to a .tmp
+# name and rename, so half-written jobs are never picked up). Finished jobs
+# are moved to done/ or failed/ with their status added.
+#
+# Socket mode: send one JSON job per connection, terminated by a newline;
+# the reply is one JSON status line once the job has run.
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import threading
+import traceback
+import socketserver
+import whisperagent as wa
+
+# =========================
+# CONFIG
+# =========================
+DEFAULT_SPOOL_DIR = "spool"
+DEFAULT_SOCKET_PATH = "/tmp/whisperagent.sock"
+POLL_SECONDS = 2.0
+
+# =========================
+# JOBS
+# =========================
+def job_id_for(job):
+    if job.get("id"):
+        job_id = str(job["id"])
+        # The id names a directory under OUTPUT_DIR and must stay inside it
+        if job_id in (".", "..") or any(sep and sep in job_id for sep in (os.sep, os.altsep)):
+            raise ValueError(f"Bad job id: {job_id!r}")
+        return job_id
+    name = os.path.splitext(os.path.basename(job.get("audio_path") or "job"))[0]
+    # Same-named clips can arrive within the same second
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{uuid.uuid4().hex[:8]}"
+
+def speakers_path_for(job):
+    if job.get("speakers_path"):
+        return job["speakers_path"]
+    return os.path.splitext(job["audio_path"])[0] + ".speakers.json"
+
+def read_job(text):
+    job = json.loads(text)
+    if not isinstance(job, dict):
+        raise ValueError("job must be a JSON object")
+    return job
+
+def process(job, model, draft):
+    t0 = time.perf_counter()
+    job_id = job.get("id")
+
+    try:
+        job_id = job_id_for(job)
+        print(f"[INFO] Job {job_id}: {job.get('audio_path')}")
+        if not job.get("audio_path"):
+            raise ValueError("Job has no audio_path")
+        wa.check_audio(job["audio_path"])
+        out_dir = os.path.join(wa.OUTPUT_DIR, job_id)
+        # In-process model only: a per-job pool would reload the model
+        out = wa.run_job(
+            job["audio_path"], model, draft,
+            out_dir=out_dir,
+            result_path=os.path.join(out_dir, "result.json"),
+            speakers_path=speakers_path_for(job),
+            workers=1
+        )
+        files = [out.txt, out.srt, out.vtt]
+
+        if job.get("emails"):
+            wa.send_email(job["emails"], files)
+
+        status = {"status": "done", "outputs": files + [out.result_path]}
+    except Exception as e:
+        traceback.print_exc()
+        status = {"status": "failed", "error": str(e)}
+
+    status.update({"id": job_id, "seconds": round(time.perf_counter() - t0, 2)})
+    print(f"[INFO] Job {job_id} {status['status']} in {status['seconds']}s")
+    return status
+
+# =========================
+# SPOOL MODE
+# =========================
+def pending_jobs(incoming):
+    names = [n for n in os.listdir(incoming) if n.endswith(".json")]
+    return sorted(names, key=lambda n: (os.path.getmtime(os.path.join(incoming, n)), n))
+
+def serve_spool(spool_dir, model, draft):
+    incoming = os.path.join(spool_dir, "incoming")
+    for sub in ("incoming", "done", "failed"):
+        wa.ensure_dir(os.path.join(spool_dir, sub))
+
+    print(f"[INFO] Watching {incoming}")
+    while True:
+        names = pending_jobs(incoming)
+        if not names:
+            time.sleep(POLL_SECONDS)
+            continue
+
+        for name in names:
+            path = os.path.join(incoming, name)
+            try:
+                with open(path) as f:
+                    job = read_job(f.read())
+                status = process(job, model, draft)
+            except ValueError as e:
+                job, status = {}, {"status": "failed", "error": f"Bad job file: {e}"}
+
+            job.update(status)
+            with open(os.path.join(spool_dir, status["status"], name), "w") as f:
+                json.dump(job, f, indent=2)
+            os.remove(path)
+
+# =========================
+# SOCKET MODE
+# =========================
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            job = read_job(self.rfile.readline())
+        except ValueError as e:
+            reply = {"status": "failed", "error": f"Bad job: {e}"}
+        else:
+            done = queue.Queue(maxsize=1)
+            self.server.jobs.put((job, done))
+            reply = done.get()
+        self.wfile.write((json.dumps(reply) + "\n").encode())
+
+def serve_socket(socket_path, model, draft):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, JobHandler)
+    server.daemon_threads = True
+    server.jobs = queue.Queue()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[INFO] Listening on {socket_path}")
+
+    # Connections are accepted concurrently, but jobs run one at a time here
+    try:
+        while True:
+            job, done = server.jobs.get()
+            done.put(process(job, model, draft))
+    finally:
+        server.shutdown()
+        os.remove(socket_path)
+
+# =========================
+# MAIN
+# =========================
+def main():
+    mode = sys.argv[1] if len(sys.argv) > 1 else "spool"
+
+    model, draft = wa.load_models(workers=1)
+    print("[INFO] Models loaded, waiting for jobs")
+
+    if mode == "spool":
+        serve_spool(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_SPOOL_DIR, model, draft)
+    elif mode == "socket":
+        serve_socket(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_SOCKET_PATH, model, draft)
+    else:
+        raise SystemExit(f"Unknown mode: {mode}")
+
+if __name__ == "__main__":
+    main()
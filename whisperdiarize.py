@@ -0,0 +1,151 @@
+# whisperdiarize.py
+# Runs NeMo diarization (vadspeaker.py) and Whisper transcription at the
+# same time, in separate processes with a split CPU budget, and joins the
+# two at the end. End-to-end time is ~max(diarize, transcribe) rather than
+# their sum.
+#
+# Usage: python whisperdiarize.py <audio_path> <emails>
+#
+# Both NeMo and Whisper must be installed in the same environment.
+import os
+import sys
+import json
+import time
+import subprocess
+import torch
+import metrics
+import speakerstore
+import whisperagent as wa
+
+# =========================
+# CONFIG
+# =========================
+# Fraction of the cores given to diarization; Whisper gets the rest
+DIARIZE_CPU_SHARE = float(os.environ.get("DIARIZE_CPU_SHARE", "0.5"))
+SPEAKERS_PATH = "speakers.json"
+SPEAKERS_METRICS_PATH = "speakers.metrics.json"  # written by vadspeaker.py
+VADSPEAKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vadspeaker.py")
+
+# =========================
+# CPU BUDGET
+# =========================
+def split_threads(share):
+    cores = os.cpu_count() or 1
+    if cores == 1:
+        return 1, 1
+    diarize = min(cores - 1, max(1, round(cores * share)))
+    return diarize, cores - diarize
+
+def thread_env(threads):
+    n = str(threads)
+    return dict(os.environ, OMP_NUM_THREADS=n, MKL_NUM_THREADS=n, OPENBLAS_NUM_THREADS=n)
+
+# =========================
+# STAGES
+# =========================
+def start_diarization(audio_path, threads):
+    # A stale speakers.json/.npz must never be mistaken for this run's output
+    speakerstore.remove(SPEAKERS_PATH)
+    if os.path.exists(SPEAKERS_METRICS_PATH):
+        os.remove(SPEAKERS_METRICS_PATH)
+
+    print(f"[INFO] Starting diarization with {threads} threads")
+    return subprocess.Popen([sys.executable, VADSPEAKER, audio_path], env=thread_env(threads))
+
+def transcribe(audio_path, threads):
+    # Speakers are not known yet: plan chunks from energy and assign later
+    if wa.SPEECH_SOURCE == "speakers":
+        wa.SPEECH_SOURCE = "energy"
+
+    torch.set_num_threads(threads)
+    if wa.WORKERS > 1 and wa.TORCH_THREADS <= 0:
+        wa.TORCH_THREADS = max(1, threads // wa.WORKERS)
+
+    print(f"[INFO] Transcribing with {threads} threads")
+    # Finished segments wait for diarization in compact form, not as
+    # Whisper's dicts with their token lists
+    store = wa.SegmentStore()
+    stats = {}
+    cache = wa.open_cache(audio_path, [])
+    if cache is not None and cache.complete():
+        print("[INFO] Cache: transcript already complete, skipping decode")
+        for _, segs in cache.results():
+            store.extend(segs)
+        return store, stats
+
+    model, draft = wa.load_models()
+
+    def run(todo):
+        return wa.chunk_results(model, todo, wa.WORKERS, draft, stats)
+
+    if wa.PIPELINE:
+        chunks = wa.stream_chunks(audio_path, wa.CHUNK_SECONDS)
+    else:
+        chunks = wa.chunk_audio(audio_path, wa.CHUNK_SECONDS)
+
+    results = wa.cached_chunk_results(cache, chunks, run) if cache is not None else run(chunks)
+    for _, segs in results:
+        store.extend(segs)
+    return store, stats
+
+# =========================
+# MAIN
+# =========================
+def main():
+    audio_path = sys.argv[1]
+    emails = sys.argv[2]
+
+    wa.check_audio(audio_path)
+    wa.ensure_dir(wa.OUTPUT_DIR)
+    metrics.start("whisperdiarize")
+
+    # Decode once, up front: both processes then read the same cached PCM
+    audio_path = wa.normalized_audio(audio_path)
+
+    diarize_threads, whisper_threads = split_threads(DIARIZE_CPU_SHARE)
+
+    t0 = time.perf_counter()
+    diarizer = start_diarization(audio_path, diarize_threads)
+
+    try:
+        store, stats = transcribe(audio_path, whisper_threads)
+    except BaseException:
+        diarizer.kill()
+        raise
+    transcribe_s = time.perf_counter() - t0
+
+    print("[INFO] Transcription done, waiting for diarization...")
+    code = diarizer.wait()
+    total_s = time.perf_counter() - t0
+    # Time until diarization was joined; vadspeaker.py reports its own stages
+    metrics.add("diarization", total_s)
+    if os.path.exists(SPEAKERS_METRICS_PATH):
+        with open(SPEAKERS_METRICS_PATH) as f:
+            metrics.note("diarization", json.load(f))
+
+    if code == 0 and os.path.exists(SPEAKERS_PATH):
+        speakers = wa.load_speakers(SPEAKERS_PATH)
+    else:
+        print(f"[WARN] Diarization failed (exit {code}), speakers will be UNKNOWN")
+        speakers = []
+
+    with metrics.span("speakers"):
+        store.assign(wa.SpeakerIndex(speakers))
+    with wa.TranscriptWriter(wa.OUTPUT_DIR) as out:
+        wa.write_store(store, out)
+
+    print(f"[INFO] Wrote {out.count} segments")
+    print(f"[INFO] Transcription {transcribe_s:.1f}s, end-to-end {total_s:.1f}s")
+    metrics.note("segments", out.count)
+    wa.report_escalation(stats)
+    metrics.finish(os.path.join(os.path.dirname(out.result_path), "metrics.json"))
+
+    if wa.CACHE_DIR:
+        wa.evict_cache()
+
+    wa.send_email(emails, [out.txt, out.srt, out.vtt])
+
+    print("✅ DONE")
+
+if __name__ == "__main__":
+    main()